@@ -30,7 +30,6 @@ import os
 import sys
 import json
 import importlib
-import traceback
 from typing import Any
 from dataclasses import dataclass
 from datetime import datetime, timezone
@@ -42,13 +41,16 @@ sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 from main import \
     helpers, \
     dna_generator, \
+    dna_codec, \
     exporter, \
+    auditor, \
     headless_util, \
     intermediate, \
     logic, \
     material_generator, \
     metadata_templates, \
-    refactorer
+    refactorer, \
+    sampler
 
 from UILists import \
     custom_metadata_ui_list, \
@@ -59,13 +61,16 @@ if "bpy" in locals():
     modules = {
         "helpers": helpers,
         "dna_generator": dna_generator,
+        "dna_codec": dna_codec,
         "exporter": exporter,
+        "auditor": auditor,
         "headless_util": headless_util,
         "intermediate": intermediate,
         "logic": logic,
         "material_generator": material_generator,
         "metadata_templates": metadata_templates,
         "refactorer": refactorer,
+        "sampler": sampler,
         "custom_metadata_ui_list": custom_metadata_ui_list,
         "logic_ui_list": logic_ui_list,
     }
@@ -78,36 +83,124 @@ if "bpy" in locals():
 # Used for updating text and buttons in UI panels
 
 combinations: int = 0
+combinations_exact: bool = True
 recommended_limit: int = 0
 dt = datetime.now(timezone.utc).astimezone()  # Date Time in UTC local
 
 
-@persistent
-def refresh_ui(dummy1, dummy2):
+# Seconds without collection updates to wait for before refreshing, merges bursts of updates into a single refresh:
+REFRESH_UI_DELAY = 0.25
+
+# Fingerprint of the collection tree, Logic rules and Materials combinations was last computed from, see
+# helpers.get_collection_fingerprint():
+refresh_ui_fingerprint = None
+
+
+def get_ui_logic_rules(input_tool):
+    """Returns the Logic rules set in the UI in the format of Logic.json, or None if Logic is off or not loadable."""
+    if not input_tool.enable_logic:
+        return None
+
+    if input_tool.enable_logic_json:
+        logic_path = bpy.path.abspath(input_tool.logic_file)
+        if not os.path.isfile(logic_path):
+            return None
+        try:
+            with open(logic_path) as logic_json:
+                return json.load(logic_json)
+        except ValueError:
+            return None
+
+    return intermediate.get_ui_logic_file(bpy.context.scene)
+
+
+def get_ui_materials(input_tool):
+    """Returns the loaded materials.json set in the UI, or None if Materials are off or the file is not loadable."""
+    if not input_tool.enable_materials:
+        return None
+
+    materials_path = bpy.path.abspath(input_tool.materials_file)
+    if not os.path.isfile(materials_path):
+        return None
+    try:
+        with open(materials_path) as materials_json:
+            materials = json.load(materials_json)
+    except ValueError:
+        return None
+
+    # Malformed files are reported when creating data, the UI keeps the count without Materials:
+    if not isinstance(materials, dict) or not all("Material List" in materials[v] for v in materials):
+        return None
+    return materials
+
+
+def refresh_combinations():
     """
-    Refreshes the UI upon user interacting with Blender (using depsgraph_update_post handler). Might be a better handler
-    to use.
+    Recomputes combinations if the collection tree, the Logic rules or the Materials changed since the last refresh,
+    then redraws the 3D View so panels show the new values. With Logic enabled, only combinations that satisfy the
+    rules are counted. With Materials enabled, each Material of a Variant counts as a distinct combination. Runs as a
+    bpy.app.timers callback scheduled by refresh_ui().
     """
     global combinations
+    global combinations_exact
     global recommended_limit
+    global refresh_ui_fingerprint
+
+    logic_rules = get_ui_logic_rules(bpy.context.scene.input_tool)
+    materials = get_ui_materials(bpy.context.scene.input_tool)
+    fingerprint = (
+        helpers.get_collection_fingerprint(),
+        json.dumps(logic_rules, sort_keys=True),
+        json.dumps(materials, sort_keys=True)
+    )
+    if fingerprint == refresh_ui_fingerprint:
+        return None
+
+    hierarchy = helpers.get_hierarchy()
+    combinations = helpers.get_combinations(hierarchy, materials)
+    combinations_exact = True
+    if logic_rules:
+        try:
+            logic_program = logic.compile_logic(hierarchy, logic_rules, False, report_unknown_items=False)
+        except (KeyError, TypeError, AttributeError):
+            # Malformed rules are reported when creating data, the UI keeps the count without Logic:
+            logic_program = None
+        if logic_program is not None:
+            combinations, combinations_exact = logic.count_valid_combinations(
+                    logic_program,
+                    material_counts=dna_codec.get_material_counts(hierarchy, materials),
+                    budget=logic.CountBudget(logic.UI_COUNT_MAX_NODES, logic.UI_COUNT_MAX_SECONDS)
+            )
 
-    combinations = (helpers.get_combinations())
     recommended_limit = int(round(combinations / 2))
+    refresh_ui_fingerprint = fingerprint
 
-    # Add panel classes that require refresh to this refresh_panels tuple:
-    refresh_panel_classes = (
-        BMNFTS_PT_CreateData,
-    )
+    window_manager = bpy.context.window_manager
+    if window_manager is not None:
+        for window in window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'VIEW_3D':
+                    area.tag_redraw()
+
+    return None
 
-    def redraw_panel(panels):
-        for i in panels:
-            try:
-                bpy.utils.unregister_class(i)
-            except Exception:
-                print(traceback.format_exc())
-            bpy.utils.register_class(i)
 
-    redraw_panel(refresh_panel_classes)
+@persistent
+def refresh_ui(scene, depsgraph):
+    """
+    Refreshes the UI upon user interacting with Blender (using depsgraph_update_post handler). Only updates to
+    collections, or to the scene properties holding the Logic rules and Materials, can change the number of
+    combinations, so other updates such as viewport transforms are ignored, and the refresh itself is deferred until
+    those updates stop for REFRESH_UI_DELAY seconds.
+    """
+    if refresh_ui_fingerprint is not None and not (
+            depsgraph.id_type_updated('COLLECTION') or depsgraph.id_type_updated('SCENE')
+    ):
+        return
+
+    if bpy.app.timers.is_registered(refresh_combinations):
+        bpy.app.timers.unregister(refresh_combinations)
+    bpy.app.timers.register(refresh_combinations, first_interval=REFRESH_UI_DELAY)
 
 
 bpy.app.handlers.depsgraph_update_post.append(refresh_ui)
@@ -178,6 +271,10 @@ class BMNFTData:
     failed_dna: Any = None
     failed_dna_index: Any = None
 
+    seed: Any = None
+    workers: int = 1
+    logic_mode: str = "REPAIR"
+
     def __post_init__(self):
         self.custom_fields = {}
 
@@ -202,6 +299,7 @@ def get_bmnft_data():
 
         enable_logic=bpy.context.scene.input_tool.enable_logic,
         enable_logic_json=bpy.context.scene.input_tool.enable_logic_json,
+        logic_mode=bpy.context.scene.input_tool.logic_mode,
         logic_file=bpy.path.abspath(bpy.context.scene.input_tool.logic_file),
 
         enable_images=bpy.context.scene.input_tool.image_bool,
@@ -353,6 +451,9 @@ def run_as_headless():
     if args.batch_number:
         settings.batch_to_generate = args.batch_number
 
+    if args.logic_mode:
+        settings.logic_mode = args.logic_mode.upper()
+
     if args.start_frame:
         hack_start_frame = args.start_frame
     else:
@@ -368,9 +469,18 @@ def run_as_headless():
     if args.batch_data_path:
         input.batch_json_save_path = args.batch_data_path
 
+    input.seed = args.seed
+    input.workers = args.workers
+
     if args.operation == 'create-dna':
         intermediate.send_to_record(input)
 
+    elif args.operation == 'extend-dna':
+        intermediate.extend_record(input)
+
+    elif args.operation == 'audit-logic':
+        intermediate.audit_record(input, args.repair)
+
     elif args.operation == 'generate-nfts':
         intermediate.render_and_save_nfts(input, hack_start_frame, hack_end_frame)
 
@@ -420,6 +530,16 @@ class BMNFTS_PGT_Input_Properties(bpy.types.PropertyGroup):
         maxlen=1024,
         subtype="FILE_PATH"
     )
+    logic_mode: bpy.props.EnumProperty(
+        name="Logic Mode",
+        description="How DNA are made to follow Logic rules",
+        items=[
+            ('REPAIR', "Repair", "Draw DNA at random, then change the Variants that break a rule"),
+            ('CONSTRAINT', "Constraint", "Only draw Variants allowed by the rules, every DNA is valid when drawn"),
+            ('CONDITIONAL', "Conditional", "Draw whole combinations allowed by the rules, weighted so that each "
+                                           "Variant keeps its rarity")
+        ]
+    )
 
     enable_materials: bpy.props.BoolProperty(
         name="Enable Materials"
@@ -619,6 +739,61 @@ class CreateData(bpy.types.Operator):
         return context.window_manager.invoke_confirm(self, event)
 
 
+class ExtendData(bpy.types.Operator):
+    bl_idname = 'extend.data'
+    bl_label = 'Extend Data'
+    bl_description = 'Adds new NFT Data to the existing NFTRecord.json up to the NFT Collection Size. Existing DNA ' \
+                     'and Batches are kept.'
+    bl_options = {"REGISTER", "UNDO"}
+
+    def execute(self, context):
+        helpers.activate_logging()
+
+        input = get_bmnft_data()
+
+        if input.enable_logic:
+            if input.enable_logic_json and not input.logic_file:
+                self.report({'ERROR'},
+                            f"No Logic.json file path set. Please set the file path to your Logic.json file.")
+                return {"CANCELLED"}
+
+        intermediate.extend_record(input)
+
+        self.report({'INFO'}, f"NFT Data extended!")
+        return {"FINISHED"}
+
+
+class AuditLogic(bpy.types.Operator):
+    bl_idname = 'audit.logic'
+    bl_label = 'Audit Logic'
+    bl_description = 'Checks the existing NFT Data against the current Logic rules and reports the DNA breaking ' \
+                     'them. With Repair, only these DNA are replaced and marked as not complete.'
+    bl_options = {"REGISTER", "UNDO"}
+
+    repair: BoolProperty(
+        default=False,
+        name="Repair")
+
+    def execute(self, context):
+        helpers.activate_logging()
+
+        input = get_bmnft_data()
+
+        if not input.enable_logic:
+            self.report({'ERROR'}, f"Enable Logic to audit NFT Data against Logic rules.")
+            return {"CANCELLED"}
+
+        if input.enable_logic_json and not input.logic_file:
+            self.report({'ERROR'},
+                        f"No Logic.json file path set. Please set the file path to your Logic.json file.")
+            return {"CANCELLED"}
+
+        intermediate.audit_record(input, self.repair)
+
+        self.report({'INFO'}, f"NFT Data {'repaired' if self.repair else 'audited'}! See the console for the report.")
+        return {"FINISHED"}
+
+
 class ExportNFTs(bpy.types.Operator):
     bl_idname = 'exporter.nfts'
     bl_label = 'Export NFTs'
@@ -846,7 +1021,7 @@ class BMNFTS_PT_CreateData(bpy.types.Panel):
         row.prop(input_tool_scene, "nft_name")
 
         row = layout.row()
-        layout.label(text=f"Maximum Number Of NFTs: {combinations}")
+        layout.label(text=f"Maximum Number Of NFTs: {'' if combinations_exact else 'up to '}{combinations}")
         layout.label(text=f"Recommended limit: {recommended_limit}")
 
         row = layout.row()
@@ -895,6 +1070,13 @@ class BMNFTS_PT_CreateData(bpy.types.Panel):
                 row = layout.row()
                 row.prop(input_tool_scene, "logic_file")
 
+            row = layout.row()
+            row.prop(input_tool_scene, "logic_mode")
+
+            row = layout.row()
+            row.operator("audit.logic", icon='VIEWZOOM', text="Audit Logic").repair = False
+            row.operator("audit.logic", icon='MODIFIER', text="Repair Logic").repair = True
+
         row = layout.row()
         row.prop(input_tool_scene, "enable_materials")
 
@@ -904,6 +1086,7 @@ class BMNFTS_PT_CreateData(bpy.types.Panel):
 
         row = layout.row()
         self.layout.operator("create.data", icon='DISCLOSURE_TRI_RIGHT', text="Create Data")
+        self.layout.operator("extend.data", icon='ADD', text="Extend Data")
         row = layout.row()
         layout.label(text=f"{BMNFTS_VERSION}")
 
@@ -1157,6 +1340,8 @@ classes = (
 
               # Operator Classes:
               CreateData,
+              ExtendData,
+              AuditLogic,
               ExportNFTs,
               ResumeFailedBatch,
               RefactorBatches,
@@ -0,0 +1,295 @@
+# Purpose:
+# This file audits the DNA of an existing NFTRecord.json, or of the Batch#.json files, against the current Logic rules.
+# DNA that break a rule are reported by order number, and can optionally be repaired in place, leaving every other DNA
+# of the collection and its completion state untouched.
+
+import os
+import json
+import logging
+
+import numpy as np
+
+from . import logic, material_generator, sampler, dna_codec
+from .helpers import TextColors
+
+log = logging.getLogger(__name__)
+
+# Name of the audit report saved next to NFTRecord.json:
+AUDIT_FILE_NAME = "LogicAudit.json"
+
+# Number of valid DNA drawn to replace a DNA whose repair collides with another DNA of the collection, before giving up:
+MAX_REDRAWS = 1000
+
+
+def format_order_nums(order_nums):
+    """Returns a sorted list of order numbers as compact ranges, e.g. "1-4, 9, 12-15"."""
+    ranges = []
+    for order_num in sorted(order_nums):
+        if ranges and order_num == ranges[-1][1] + 1:
+            ranges[-1][1] = order_num
+        else:
+            ranges.append([order_num, order_num])
+
+    return ", ".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def get_batch_files(batch_json_save_path):
+    """Returns the paths of the Batch#.json files in batch_json_save_path, in Batch number order."""
+    if not os.path.exists(batch_json_save_path):
+        return []
+
+    batch_numbers = sorted(
+        int(i[len("Batch"):-len(".json")]) for i in os.listdir(batch_json_save_path)
+        if i.startswith("Batch") and i.endswith(".json") and i[len("Batch"):-len(".json")].isdigit()
+    )
+    return [os.path.join(batch_json_save_path, f"Batch{i}.json") for i in batch_numbers]
+
+
+def read_dna_lists(nft_record_path, batch_json_save_path):
+    """
+    Yields the hierarchy and the DNA lists to audit, one list at a time: the dna_list of NFTRecord.json if it exists,
+    otherwise the batch_dna_list of each Batch#.json file.
+    """
+    if os.path.exists(nft_record_path):
+        data_dictionary = json.load(open(nft_record_path))
+        yield data_dictionary["hierarchy"], data_dictionary["dna_list"]
+        return
+
+    for batch_file in get_batch_files(batch_json_save_path):
+        batch = json.load(open(batch_file))
+        if "hierarchy" in batch:
+            hierarchy = batch["hierarchy"]
+        else:
+            hierarchy = json.load(open(os.path.join(batch_json_save_path, batch["hierarchy_file"])))
+        yield hierarchy, batch["batch_dna_list"]
+
+
+def audit_dna_list(dna_list, program, codec):
+    """
+    Evaluates a DNA list formatted as in NFTRecord.json against every rule of program at once. Returns a dictionary of
+    each broken rule name and the sorted order numbers of the DNA breaking it. A rule with both THEN and NOT lists is
+    compiled to two rules of the same name, the DNA breaking either are listed under that name.
+    """
+    dna_strings = [list(i.keys())[0] for i in dna_list]
+    order_nums = [list(i.values())[0]["order_num"] for i in dna_list]
+
+    matrix = codec.rows_from_dna([dna.partition(":")[0] for dna in dna_strings])
+    violations = {}
+    for rule, mask in zip(program.rules, program.violation_masks(matrix)):
+        if mask.any():
+            violations.setdefault(rule.name, set()).update(order_nums[j] for j in np.flatnonzero(mask))
+    return {rule_name: sorted(order_nums) for rule_name, order_nums in violations.items()}
+
+
+def repair_dna(hierarchy, dna, program, codec, enable_rarity, material_index, rng, existing_dna, redraw):
+    """
+    Returns a DNA string satisfying every rule of program to replace dna, unique against existing_dna, or None if none
+    could be found. The rules are first repaired as during generation. If that fails, or makes dna a duplicate, valid
+    DNA are drawn from redraw(), a function returning a DNA row or None, instead. Material numbers are kept for the
+    Attributes whose Variant did not change and drawn again from material_index, a material_generator.MaterialIndex or
+    None if there is no materials file, for the others.
+    """
+    single_dna, _, material_dna = dna.partition(":")
+    original_row = codec.row_from_dna(single_dna)
+
+    candidates = []
+    row = original_row.copy()
+    if program.apply(row, rng):
+        candidates.append(row)
+
+    for i in range(MAX_REDRAWS):
+        if i >= len(candidates):
+            candidates.append(redraw())
+        if candidates[i] is None:
+            return None
+
+        new_dna = codec.dna_from_row(candidates[i])
+        if material_dna:
+            old_materials = material_dna.split("-")
+            if material_index is not None:
+                new_materials = material_generator.apply_materials(
+                        hierarchy,
+                        codec.numbers_from_row(candidates[i]),
+                        None,
+                        enable_rarity,
+                        rng,
+                        material_index
+                )
+            else:
+                new_materials = [0] * codec.num_attributes
+            new_dna += ":" + "-".join(
+                old_materials[j] if candidates[i][j] == original_row[j] else str(new_materials[j])
+                for j in range(codec.num_attributes)
+            )
+
+        if new_dna not in existing_dna:
+            return new_dna
+
+    return None
+
+
+def replace_dna(dna_list, replacements):
+    """
+    Replaces in place the DNA of the entries of dna_list whose order number is in replacements, a dictionary of order
+    numbers and new DNA strings. Replaced entries are marked as not complete. Returns the number of replaced entries.
+    """
+    num_replaced = 0
+    for index, entry in enumerate(dna_list):
+        (dna, data), = entry.items()
+        if data["order_num"] in replacements:
+            dna_list[index] = {replacements[data["order_num"]]: {**data, "complete": False}}
+            num_replaced += 1
+    return num_replaced
+
+
+def audit_record(
+        enable_rarity,
+        logic_file,
+        materials_file,
+        blend_my_nfts_output,
+        batch_json_save_path,
+        repair=False,
+        seed=None
+):
+    """
+    Audits NFTRecord.json, or the Batch#.json files if there is no NFTRecord.json, against the Logic rules of
+    logic_file, then logs and saves to LogicAudit.json the order numbers of the DNA breaking each rule.
+
+    If repair is True, only the DNA breaking a rule are replaced, in NFTRecord.json and in the Batch#.json files. Their
+    NFTs are marked as not complete so that they are rendered again, every other DNA is left untouched. materials_file
+    is the path of the materials file if Materials are enabled, None otherwise.
+    """
+    nft_record_path = os.path.join(blend_my_nfts_output, "NFTRecord.json")
+
+    violations = {}
+    hierarchy = None
+    program = None
+    codec = None
+    num_audited = 0
+    for dna_list_hierarchy, dna_list in read_dna_lists(nft_record_path, batch_json_save_path):
+        if program is None:
+            hierarchy = dna_list_hierarchy
+            program = logic.get_logic_program(hierarchy, logic_file, enable_rarity)
+            codec = dna_codec.DNACodec(hierarchy)
+
+        for rule_name, order_nums in audit_dna_list(dna_list, program, codec).items():
+            violations.setdefault(rule_name, []).extend(order_nums)
+        num_audited += len(dna_list)
+
+    if program is None:
+        log.error(
+                f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
+                f"No NFTRecord.json or Batch files found to audit. Create NFT Data first. For more information, "
+                f"see:\n{TextColors.RESET}"
+                f"https://github.com/torrinworx/Blend_My_NFTs#logic\n"
+        )
+        raise FileNotFoundError(nft_record_path)
+
+    violating = sorted({order_num for order_nums in violations.values() for order_num in order_nums})
+    report = "\nLogic audit:"
+    report += f"\n - {num_audited} DNA audited, {len(violating)} break at least one rule."
+    for rule_name, order_nums in violations.items():
+        report += f"\n - {rule_name}: {len(order_nums)} DNA ({format_order_nums(order_nums)})"
+
+    audit = {
+        "num_audited": num_audited,
+        "num_violating": len(violating),
+        "violations": {rule_name: format_order_nums(order_nums) for rule_name, order_nums in violations.items()},
+    }
+
+    if not violating:
+        log.info(f"\n{TextColors.OK}{report}\nAll DNA satisfy the Logic rules.{TextColors.RESET}")
+    else:
+        log.warning(f"\n{TextColors.WARNING}{report}{TextColors.RESET}")
+
+    if repair and violating:
+        audit["repaired"] = repair_violations(
+                hierarchy,
+                program,
+                codec,
+                set(violating),
+                enable_rarity,
+                materials_file,
+                nft_record_path,
+                batch_json_save_path,
+                seed
+        )
+
+    if os.path.exists(blend_my_nfts_output):
+        with open(os.path.join(blend_my_nfts_output, AUDIT_FILE_NAME), "w") as outfile:
+            outfile.write(json.dumps(audit, indent=1, ensure_ascii=True) + "\n")
+
+    return audit
+
+
+def repair_violations(
+        hierarchy,
+        program,
+        codec,
+        violating,
+        enable_rarity,
+        materials_file,
+        nft_record_path,
+        batch_json_save_path,
+        seed
+):
+    """
+    Replaces the DNA with order numbers in violating in NFTRecord.json and the Batch#.json files, see audit_record().
+    Returns the order numbers that were repaired as compact ranges.
+    """
+    seed_sequence = np.random.SeedSequence(seed)
+    log.info(f"\nLogic repair seed: {seed_sequence.entropy}")
+    rng = np.random.default_rng(seed_sequence)
+
+    # The DNA of the whole collection, repaired DNA must stay unique against them:
+    existing_dna = {}
+    for dna_list_hierarchy, dna_list in read_dna_lists(nft_record_path, batch_json_save_path):
+        for entry in dna_list:
+            (dna, data), = entry.items()
+            existing_dna[dna] = data["order_num"]
+
+    constraint_sampler = sampler.ConstraintSampler(hierarchy, program, enable_rarity)
+    material_index = None
+    if materials_file:
+        material_index = material_generator.MaterialIndex(hierarchy, json.load(open(materials_file)), enable_rarity)
+
+    def redraw():
+        values = constraint_sampler.draw_one(rng)
+        return np.array(values, dtype=codec.dtype) if values is not None else None
+
+    replacements = {}
+    for dna, order_num in list(existing_dna.items()):
+        if order_num not in violating:
+            continue
+
+        new_dna = repair_dna(hierarchy, dna, program, codec, enable_rarity, material_index, rng, existing_dna, redraw)
+        if new_dna is None:
+            log.warning(
+                    f"\n{TextColors.WARNING}Blend_My_NFTs Warning:\n"
+                    f"No unique DNA satisfying the Logic rules could be found to replace NFT {order_num}, it was left "
+                    f"unchanged.{TextColors.RESET}"
+            )
+            continue
+
+        del existing_dna[dna]
+        existing_dna[new_dna] = order_num
+        replacements[order_num] = new_dna
+
+    if os.path.exists(nft_record_path):
+        data_dictionary = json.load(open(nft_record_path))
+        replace_dna(data_dictionary["dna_list"], replacements)
+        with open(nft_record_path, "w") as outfile:
+            outfile.write(json.dumps(data_dictionary, indent=1, ensure_ascii=True) + "\n")
+
+    # Only the Batch files holding a repaired DNA are rewritten:
+    for batch_file in get_batch_files(batch_json_save_path):
+        batch = json.load(open(batch_file))
+        if replace_dna(batch["batch_dna_list"], replacements):
+            with open(batch_file, "w") as outfile:
+                outfile.write(json.dumps(batch, indent=1, ensure_ascii=True) + "\n")
+
+    log.info(
+            f"\n{TextColors.OK}{len(replacements)} DNA breaking the Logic rules were repaired, their NFTs are marked "
+            f"as not complete and can be generated again.{TextColors.RESET}"
+    )
+    return format_order_nums(replacements)
@@ -0,0 +1,170 @@
+# Purpose:
+# This file converts NFT DNA between the DNA strings saved to NFTRecord.json ("1-3-2-4" or "1-3-2-4:0-1-0-2" with
+# Materials) and a compact form used internally while generating, checking and rendering DNA. In compact form a DNA is
+# a row of small integers, one digit per Attribute (and per Material slot), which maps losslessly to a single
+# mixed-radix integer key.
+
+import logging
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def get_material_counts(hierarchy, materials=None):
+    """
+    Returns, for each Attribute of hierarchy, the number of Material slots of each of its Variants in hierarchy order:
+    the length of its Material List in materials, 1 if it has none or if materials is None. Each slot is a distinct
+    NFT, so the Material digit of a DNA row multiplies the combinations of its Variant digit by this number.
+    """
+    materials = materials or {}
+    return [
+        [len(materials[v]["Material List"]) if v in materials else 1 for v in hierarchy[a]] for a in hierarchy
+    ]
+
+
+class DNACodec:
+    """
+    Compact DNA for a given hierarchy. Each Attribute digit is the 1 based position of the selected Variant in the
+    hierarchy, 0 is Empty ("0" in DNA strings). Each Material digit is the Material number used in Material DNA, 0
+    meaning no Material was selected.
+
+    Attributes are ordered as in helpers.get_hierarchy(), the first Attribute being the most significant digit of the
+    integer key.
+    """
+
+    def __init__(self, hierarchy, materials=None):
+        """
+        hierarchy: Hierarchy returned by helpers.get_hierarchy() or saved in NFTRecord.json.
+        materials: The loaded materials.json dictionary if Materials are enabled, None otherwise.
+        """
+
+        self.attributes = list(hierarchy.keys())
+        self.variants = [list(hierarchy[a].keys()) for a in self.attributes]
+        self.numbers = [[hierarchy[a][v]["number"] for v in hierarchy[a]] for a in self.attributes]
+        self.positions = [
+            {"0": 0, **{number: i + 1 for i, number in enumerate(numbers)}} for numbers in self.numbers
+        ]
+
+        self.num_attributes = len(self.attributes)
+        self.radices = [len(variants) + 1 for variants in self.variants]
+
+        self.materials = materials
+        if materials is not None:
+            self.material_lists = {
+                variant: list(materials[variant]["Material List"].keys()) for variant in materials
+            }
+            self.radices += [
+                max([len(self.material_lists.get(v, [])) for v in variants] + [0]) + 1 for variants in self.variants
+            ]
+
+        self.width = len(self.radices)
+        self.dtype = np.uint8 if max(self.radices + [1]) <= 256 else np.uint16
+
+        self.strides = [1] * self.width
+        for i in range(self.width - 2, -1, -1):
+            self.strides[i] = self.strides[i + 1] * self.radices[i + 1]
+
+        self.num_keys = self.strides[0] * self.radices[0] if self.width else 1
+        self.fits_int64 = self.num_keys < 2 ** 63
+
+        # Lookup tables used to serialize whole matrices at once:
+        self._number_lookup = [np.array(["0"] + numbers, dtype=object) for numbers in self.numbers]
+        self._digit_lookup = [np.array([str(d) for d in range(radix)], dtype=object) for radix in self.radices]
+
+    # ======== Rows and Matrices ======== #
+
+    def empty_rows(self, size):
+        """Returns a (size x width) matrix of Empty DNA rows."""
+        return np.zeros((size, self.width), dtype=self.dtype)
+
+    def numbers_from_row(self, row):
+        """Returns the deconstructed DNA of a row, a list of Variant numbers as found in DNA strings."""
+        return [self._number_lookup[i][row[i]] for i in range(self.num_attributes)]
+
+    def row_from_numbers(self, deconstructed_dna, row=None):
+        """Writes a deconstructed DNA (list of Variant numbers) into the Attribute digits of row."""
+        if row is None:
+            row = np.zeros(self.width, dtype=self.dtype)
+
+        for i, number in enumerate(deconstructed_dna):
+            row[i] = self.positions[i][str(number)]
+        return row
+
+    def row_from_dna(self, dna):
+        """Returns the compact row of a DNA string."""
+        single_dna, _, material_dna = dna.partition(":")
+        row = self.row_from_numbers(single_dna.split("-"))
+
+        if material_dna:
+            row[self.num_attributes:] = [int(m) for m in material_dna.split("-")]
+        return row
+
+    def dna_from_row(self, row):
+        """Returns the DNA string of a compact row."""
+        return self.dna_from_rows(np.asarray(row).reshape(1, -1))[0]
+
+    def rows_from_dna(self, dna_list):
+        """Returns the (len(dna_list) x width) matrix of a list of DNA strings."""
+        matrix = self.empty_rows(len(dna_list))
+        for i, dna in enumerate(dna_list):
+            matrix[i] = self.row_from_dna(dna)
+        return matrix
+
+    def dna_from_rows(self, matrix):
+        """Returns the list of DNA strings of a matrix, only called where DNA leave the compact form."""
+        matrix = np.asarray(matrix)
+        columns = [self._number_lookup[i][matrix[:, i]] for i in range(self.num_attributes)]
+        dna_list = ["-".join(digits) for digits in zip(*columns)]
+
+        if self.materials is not None:
+            material_columns = [
+                self._digit_lookup[i][matrix[:, i]] for i in range(self.num_attributes, self.width)
+            ]
+            dna_list = [f"{dna}:{'-'.join(digits)}" for dna, digits in zip(dna_list, zip(*material_columns))]
+
+        return dna_list
+
+    # ======== Integer keys ======== #
+
+    def encode(self, row):
+        """Returns the mixed-radix integer of a row."""
+        key = 0
+        for digit, radix in zip(row, self.radices):
+            key = key * radix + int(digit)
+        return key
+
+    def decode(self, key):
+        """Returns the row of a mixed-radix integer."""
+        row = np.zeros(self.width, dtype=self.dtype)
+        for i in range(self.width - 1, -1, -1):
+            key, row[i] = divmod(key, self.radices[i])
+        return row
+
+    def keys(self, matrix):
+        """Returns the list of integer keys of every row in matrix, used to check DNA for uniqueness."""
+        if self.fits_int64:
+            return (np.asarray(matrix, dtype=np.int64) @ np.array(self.strides, dtype=np.int64)).tolist()
+        return (np.asarray(matrix).astype(object) @ np.array(self.strides, dtype=object)).tolist()
+
+    # ======== Names ======== #
+
+    def variant_names(self, row):
+        """Returns a dictionary of each Attribute and its selected Variant in row, "0" if the Attribute is Empty."""
+        return {
+            attribute: self.variants[i][row[i] - 1] if row[i] else "0" for i, attribute in enumerate(self.attributes)
+        }
+
+    def material_names(self, row):
+        """
+        Returns a dictionary of each selected Variant in row and the name of its selected Material, "0" if no Material
+        was selected.
+        """
+        material_dictionary = {}
+        for i, variant in enumerate(self.variant_names(row).values()):
+            material = int(row[self.num_attributes + i])
+            if material:
+                material_dictionary[variant] = self.material_lists[variant][material - 1]
+            else:
+                material_dictionary[variant] = "0"
+        return material_dictionary
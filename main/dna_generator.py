@@ -4,155 +4,460 @@
 import os
 import time
 import json
-import random
 import logging
 import traceback
-from functools import partial
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
-from . import logic, material_generator, helpers
+import numpy as np
+
+from . import logic, material_generator, helpers, sampler, dna_codec
 from .helpers import TextColors
 
 log = logging.getLogger(__name__)
 
+# Once collection_size reaches this fraction of all possible combinations, DNA are drawn without replacement from the
+# combination space instead of being drawn at random and deduplicated:
+ENUMERATION_FILL_RATIO = 0.5
 
-def generate_nft_dna(
+# The combination space is only enumerated up to this many combinations, a permutation of it being held in memory:
+ENUMERATION_MAX_COMBINATIONS = 1 << 22
+
+# The sampler is considered saturated, and stops, after this many consecutive draws without a new unique DNA:
+SATURATION_LIMIT = 10000
+
+# Name of the hierarchy file shared by all Batch#.json files in the Batch_Data folder:
+HIERARCHY_FILE_NAME = "Hierarchy.json"
+
+
+def generate_dna_matrix(
+        hierarchy,
         collection_size,
         enable_rarity,
         enable_logic,
         logic_file,
         enable_materials,
         materials_file,
+        seed_sequence,
+        enumerate_combinations=False,
+        saturation_limit=SATURATION_LIMIT,
+        excluded_keys=(),
+        logic_program=None,
+        logic_mode="REPAIR",
+        logic_sampler=None,
 ):
     """
-    Returns batchDataDictionary containing the number of NFT combinations, hierarchy, and the dna_list.
-    """
-
-    hierarchy = helpers.get_hierarchy()
+    Generates up to collection_size unique DNA rows (see dna_codec.py) from a single random stream seeded by
+    seed_sequence, leaving out any DNA whose integer key is in excluded_keys. Returns the DNA matrix and the sampler
+    statistics used by create_saturation_report(). logic_program is the logic.RuleProgram of logic_file, compiled here
+    if None.
 
-    # DNA random, Rarity and Logic methods:
-    data_dictionary = {}
+    With logic_mode "REPAIR", DNA are drawn at random and rows breaking a rule are repaired. With logic_mode
+    "CONSTRAINT", DNA are drawn by a sampler.ConstraintSampler, and with logic_mode "CONDITIONAL" by a
+    sampler.ConditionalSampler, and are valid by construction. logic_sampler is that sampler, built here if None. Rows
+    of the enumeration mode are fixed combinations, so they are repaired in every mode.
 
-    def create_dna_random(hierarchy):
-        """Creates a single DNA randomly without Rarity or Logic."""
-        dna_str = ""
-        dna_str_list = []
-        list_option_variant = []
-
-        for i in hierarchy:
-            num_child = len(hierarchy[i])
-            possible_nums = list(range(1, num_child + 1))
-            list_option_variant.append(possible_nums)
+    This function does not use bpy, so that generate_nft_dna() can run it in worker processes.
+    """
 
-        for i in list_option_variant:
-            random_variant_num = random.choices(i, k=1)
-            str1 = ''.join(str(e) for e in random_variant_num)
-            dna_str_list.append(str1)
+    # DNA are kept as compact rows (see dna_codec.py) until they are saved:
+    materials = json.load(open(materials_file)) if enable_materials else None
+    codec = dna_codec.DNACodec(hierarchy, materials)
 
-        for i in dna_str_list:
-            num = "-" + str(i)
-            dna_str += num
+    # Weight tables are built once, then whole batches of DNA are drawn from them:
+    attribute_sampler = sampler.AttributeSampler(hierarchy, enable_rarity, materials)
+    rng = np.random.default_rng(seed_sequence)
 
-        dna = ''.join(dna_str.split('-', 1))
+    # materials.json is indexed once, not parsed again for every DNA:
+    material_index = material_generator.MaterialIndex(hierarchy, materials, enable_rarity) if enable_materials else None
 
-        return str(dna)
+    if enable_logic and logic_program is None:
+        logic_program = logic.compile_logic(hierarchy, logic_file, enable_rarity)
 
-    def create_dna_rarity(hierarchy):
-        """
-        Sorts through data_dictionary and appropriately weights each variant based on their rarity percentage set in Blender
-        ("rarity" in DNA_Generator). Then
-        """
-        single_dna = ""
-
-        for i in hierarchy:
-            number_list_of_i = []
-            rarity_list_of_i = []
-            if_zero_bool = None
-
-            for k in hierarchy[i]:
-                number = hierarchy[i][k]["number"]
-                number_list_of_i.append(number)
-
-                rarity = hierarchy[i][k]["rarity"]
-                rarity_list_of_i.append(float(rarity))
-
-            for x in rarity_list_of_i:
-                if x == 0:
-                    if_zero_bool = True
-                elif x != 0:
-                    if_zero_bool = False
-
-            try:
-                if if_zero_bool:
-                    variant_by_num = random.choices(number_list_of_i, k=1)
-                elif not if_zero_bool:
-                    variant_by_num = random.choices(number_list_of_i, weights=rarity_list_of_i, k=1)
-            except IndexError:
-                raise IndexError(
-                    f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
-                    f"An issue was found within the Attribute collection '{i}'. For more information on Blend_My_NFTs "
-                    f"compatible scenes, see:\n{TextColors.RESET}"
-                    f"https://github.com/torrinworx/Blend_My_NFTs#blender-file-organization-and-structure\n"
-                )
+    if enable_logic and logic_sampler is None:
+        logic_sampler = get_logic_sampler(hierarchy, logic_program, enable_rarity, logic_mode)
 
-            single_dna += "-" + str(variant_by_num[0])
-        single_dna = ''.join(single_dna.split('-', 1))
-        return single_dna
+    # Acceptance of drawn DNA, used to detect saturation and explain it:
+    sampler_stats = {
+        "num_drawn": 0,
+        "draws_without_new": 0,
+        "saturated": False,
+        "rule_counter": Counter(),
+        "logic_conflicts": Counter(),
+        "rule_stats": logic.RuleStats(),
+    }
 
-    def single_complete_dna():
+    def repair_dna(row):
         """
-        This function applies Rarity and Logic to a single DNA created by createDNASingle() if Rarity or Logic specified
+        This function applies Logic to a single DNA row drawn by attribute_sampler that breaks a rule. Returns False if
+        conflicting Logic rules made the row impossible to repair, in which case it is dropped and another DNA is drawn
+        in its place.
         """
-
-        single_dna = ""
-        if not enable_rarity:
-            single_dna = create_dna_random(hierarchy)
+        if not logic_program.apply(
+                row,
+                rng,
+                sampler_stats["rule_counter"],
+                sampler_stats["logic_conflicts"],
+                sampler_stats["rule_stats"]
+        ):
+            return False
+        if log.isEnabledFor(logging.DEBUG):
             log.debug(
                     f"\n================"
-                    f"\nOriginal DNA: {single_dna}"
+                    f"\nLogic DNA: {codec.numbers_from_row(row)}"
             )
+        return True
+
+    # Draws the missing number of DNA as one batch per pass, applies Logic and Materials, and keeps only the rows whose
+    # integer key has not been seen yet, until collection_size DNA are kept. Stops early only once saturation_limit
+    # consecutive draws produced no new unique DNA. If enumerate_combinations is True, batches are taken in order from
+    # a random permutation of the combination space instead, so that no combination is ever drawn twice.
+    if enumerate_combinations:
+        combination_order = attribute_sampler.permutation(rng)
+
+    dna_keys = set(excluded_keys)
+    dna_rows = []
+    num_dna = 0
+
+    while num_dna < collection_size:
+        num_missing = collection_size - num_dna
+        batch = codec.empty_rows(num_missing)
+        if enumerate_combinations:
+            num_drawn = sampler_stats["num_drawn"]
+            indices = combination_order[num_drawn:num_drawn + num_missing]
+            if not len(indices):
+                break
+
+            batch = batch[:len(indices)]
+            batch[:] = attribute_sampler.rows_from_indices(indices)
+        elif logic_sampler is not None:
+            batch[:, :codec.num_attributes] = logic_sampler.draw(rng, num_missing)
+        else:
+            batch[:, :codec.num_attributes] = attribute_sampler.draw(rng, num_missing)
+        sampler_stats["num_drawn"] += len(batch)
 
-        if enable_rarity:
-            single_dna = create_dna_rarity(hierarchy)
-            log.debug(
-                    f"\n================"
-                    f"\nRarity DNA: {single_dna}"
-            )
+        # The whole batch is checked against the Logic rules at once, only the rows breaking a rule are repaired:
+        if enable_logic and (enumerate_combinations or logic_sampler is None):
+            needs_repair = logic_program.violated_rows(batch, sampler_stats["rule_stats"])
+        else:
+            needs_repair = np.zeros(len(batch), dtype=bool)
+
+        valid_rows = [True] * len(batch)
+        for j in np.flatnonzero(needs_repair):
+            valid_rows[j] = repair_dna(batch[j])
+
+        # Materials are drawn column-wise for the whole batch once its Variants are final. Enumerated combinations
+        # already hold their Materials, only the rows repaired by Logic are drawn again:
+        if enable_materials and not enumerate_combinations:
+            material_index.apply_to_rows(batch, rng)
+        elif enable_materials and needs_repair.any():
+            repaired = batch[needs_repair]
+            material_index.apply_to_rows(repaired, rng)
+            batch[needs_repair] = repaired
+
+        unique_rows = [
+            j for j, key in enumerate(codec.keys(batch))
+            if valid_rows[j] and not (key in dna_keys or dna_keys.add(key))
+        ]
+        dna_rows.append(batch[unique_rows])
+        num_dna += len(unique_rows)
+
+        # Saturation, no new unique DNA for saturation_limit draws in a row:
+        if unique_rows:
+            sampler_stats["draws_without_new"] = len(batch) - 1 - unique_rows[-1]
+        else:
+            sampler_stats["draws_without_new"] += len(batch)
 
-        if enable_logic:
-            single_dna = logic.logicafy_dna_single(hierarchy, single_dna, logic_file, enable_rarity)
-            log.debug(
-                    f"\n================"
-                    f"\nLogic DNA: {single_dna}"
-            )
+        if not enumerate_combinations and sampler_stats["draws_without_new"] >= saturation_limit:
+            sampler_stats["saturated"] = True
+            break
 
-        if enable_materials:
-            single_dna = material_generator.apply_materials(hierarchy, single_dna, materials_file, enable_rarity)
-            log.debug(
-                    f"\n================"
-                    f"\nMaterials DNA: {single_dna}"
-                    f"\n================\n"
+    dna_matrix = np.concatenate(dna_rows) if dna_rows else codec.empty_rows(0)
+    return dna_matrix, sampler_stats
+
+
+def get_logic_sampler(hierarchy, logic_program, enable_rarity, logic_mode):
+    """
+    Returns the sampler drawing valid DNA for logic_mode, None for the "REPAIR" mode. If the Attributes connected by
+    rules have too many combinations for the "CONDITIONAL" mode, falls back to the "CONSTRAINT" mode.
+    """
+    if logic_mode == "CONDITIONAL":
+        try:
+            return sampler.ConditionalSampler(hierarchy, logic_program, enable_rarity)
+        except sampler.TooManyCombinations as error:
+            log.warning(f"{error}Falling back to the Constraint logic mode.")
+            logic_mode = "CONSTRAINT"
+
+    if logic_mode == "CONSTRAINT":
+        return sampler.ConstraintSampler(hierarchy, logic_program, enable_rarity)
+    return None
+
+
+def create_saturation_report(codec, attribute_sampler, dna_matrix, sampler_stats):
+    """
+    Summarises the acceptance rate of the sampler, and the Attributes and Logic rules that limited the number of unique
+    DNA it could reach.
+    """
+    num_drawn = sampler_stats["num_drawn"]
+    report = (
+        f"\nDNA sampler summary:"
+        f"\n - {num_drawn} DNA drawn, {len(dna_matrix)} unique DNA kept "
+        f"({round(len(dna_matrix) / max(num_drawn, 1) * 100, 2)}% acceptance rate)."
+        f"\n - {attribute_sampler.num_combinations} possible combinations before Logic"
+        f"{', Materials included' if codec.materials is not None else ''}."
+    )
+    if sampler_stats["saturated"]:
+        report += (
+            f"\n - Stopped early, no new unique DNA was found in the last {sampler_stats['draws_without_new']} "
+            f"draws."
+        )
 
+    attribute_report = ""
+    for column, attribute in enumerate(codec.attributes):
+        num_variants = len(codec.variants[column])
+        variant_counts = np.bincount(dna_matrix[:, column], minlength=num_variants + 1)
+        num_selected = np.count_nonzero(variant_counts[1:])
+        probabilities = attribute_sampler.probabilities[column]
+        effective_variants = np.exp(-np.sum(probabilities * np.log(probabilities, where=probabilities > 0,
+                                                                      out=np.zeros_like(probabilities))))
+
+        if num_selected < num_variants:
+            attribute_report += f"\n - {attribute}: only {num_selected} of {num_variants} Variants were selected."
+        if effective_variants < num_variants / 2:
+            attribute_report += (
+                f"\n - {attribute}: rarity weights make it behave like {round(effective_variants, 2)} of its "
+                f"{num_variants} Variants."
             )
+        if variant_counts[0]:
+            attribute_report += f"\n - {attribute}: set to Empty by Logic in {variant_counts[0]} DNA."
 
-        return single_dna
+    if attribute_report:
+        report += f"\nAttributes limiting the number of combinations:{attribute_report}"
 
-    def create_dna_list():
-        """
-        Creates dna_list. Loops through createDNARandom() and applies Rarity, and Logic while checking if all DNA
-        are unique.
-        """
-        dna_set_return = set()
+    if sampler_stats["rule_counter"]:
+        report += f"\nLogic rules that rewrote drawn DNA:"
+        for rule, count in sampler_stats["rule_counter"].most_common():
+            report += f"\n - {rule}: rewrote {count} DNA."
+
+    if sampler_stats["logic_conflicts"]:
+        report += f"\nConflicting Logic rules that made drawn DNA impossible to repair:"
+        for rules, count in sampler_stats["logic_conflicts"].most_common():
+            report += f"\n - {' and '.join(rules)}: rejected {count} DNA."
+
+    return report
+
+
+def generate_nft_dna(
+        collection_size,
+        enable_rarity,
+        enable_logic,
+        logic_file,
+        enable_materials,
+        materials_file,
+        seed=None,
+        workers=1,
+        existing_dna=(),
+        logic_mode="REPAIR",
+        enumeration_fill_ratio=ENUMERATION_FILL_RATIO,
+        saturation_limit=SATURATION_LIMIT,
+        logic_stats_path=None,
+        loader=None,
+):
+    """
+    Returns batchDataDictionary containing the number of NFT combinations, hierarchy, and the dna_list, along with the
+    compact matrix of the same DNA (see dna_codec.py).
+
+    The collection is split into one shard per worker, each shard drawn by generate_dna_matrix() from its own child of
+    a SeedSequence built from seed. Shards are merged in order and topped up from one more child stream, so the same
+    seed and number of workers always produce the same dna_list. When the collection nears the number of valid
+    combinations, the "CONSTRAINT" and "CONDITIONAL" logic modes still draw the shards, and the DNA they miss are then
+    drawn without replacement from a last child stream.
+
+    existing_dna is a list of DNA strings already in NFTRecord.json. When given, collection_size new DNA unique against
+    them are generated, numbered from the order_num after the existing DNA. logic_mode is passed to
+    generate_dna_matrix(). With Logic on, the profile of each rule is saved to LogicStats.json in logic_stats_path if
+    given.
+
+    Worker processes are forked from the running Blender process, so workers above 1 are only meant for headless runs.
+    loader is the helpers.Loader animation of the caller, stopped before forking so that no thread of the add-on holds
+    a lock in the forked workers.
+    """
+
+    hierarchy = helpers.get_hierarchy()
+
+    # DNA random, Rarity and Logic methods:
+    data_dictionary = {}
 
-        for i in range(collection_size):
-            dna_push_to_list = partial(single_complete_dna)
+    materials = json.load(open(materials_file)) if enable_materials else None
+    codec = dna_codec.DNACodec(hierarchy, materials)
+    attribute_sampler = sampler.AttributeSampler(hierarchy, enable_rarity, materials)
 
-            dna_set_return |= {''.join([dna_push_to_list()]) for _ in range(collection_size - len(dna_set_return))}
+    workers = max(int(workers), 1)
+    seed_sequence = np.random.SeedSequence(seed)
+    shard_seeds = seed_sequence.spawn(workers + 1)
+    log.info(f"\n - DNA seed: {seed_sequence.entropy}. Pass it as --seed to generate the same DNA again.")
 
-        dna_list_non_formatted = list(dna_set_return)
+    existing_keys = set(codec.keys(codec.rows_from_dna(existing_dna)))
 
+    # Rules are compiled once here rather than by every shard, and only if they changed since the last run:
+    logic_program = logic.get_logic_program(hierarchy, logic_file, enable_rarity) if enable_logic else None
+
+    # Pre-check, the number of DNA that satisfy the Logic rules. If it is exact and below collection_size, generation
+    # stops once all of them are found instead of drawing until the sampler saturates:
+    num_to_generate = collection_size
+    num_combinations = attribute_sampler.num_combinations
+    num_valid, exact = num_combinations, True
+    if enable_logic:
+        logic_warnings, logic_report = logic.analyze_logic(hierarchy, logic_program)
+        for warning in logic_warnings:
+            log.warning(
+                    f"\n{TextColors.WARNING}Blend_My_NFTs Warning:\n{warning} For more information, see:"
+                    f"\n{TextColors.RESET}https://github.com/torrinworx/Blend_My_NFTs#logic\n"
+            )
+        if logic_report:
+            log.info(f"\nLogic rules:{logic_report}")
+
+        material_counts = dna_codec.get_material_counts(hierarchy, materials) if enable_materials else None
+        num_valid, exact = logic.count_valid_combinations(logic_program, material_counts=material_counts)
+        log.info(f"\n - {'' if exact else 'At most '}{num_valid} combinations satisfy the Logic rules.")
+
+        if exact and not existing_keys and collection_size > num_valid:
+            log.warning(
+                    f"\n{TextColors.WARNING}Blend_My_NFTs Warning:\n"
+                    f"Only {num_valid} DNA satisfy your Logic rules, fewer than the {collection_size} NFTs requested. "
+                    f"{num_valid} DNA will be generated.{TextColors.RESET}"
+            )
+            num_to_generate = num_valid
+
+    # So is the sampler of the logic mode:
+    logic_sampler = get_logic_sampler(hierarchy, logic_program, enable_rarity, logic_mode) if enable_logic else None
+
+    # The collection is measured against the combinations satisfying the Logic rules when their count is exact:
+    num_reachable = num_valid if exact else num_combinations
+    num_total = num_to_generate + len(existing_keys)
+    enumerate_combinations = (
+            num_total >= enumeration_fill_ratio * num_reachable and num_combinations <= ENUMERATION_MAX_COMBINATIONS
+    )
+
+    # The Constraint and Conditional logic modes still draw their own DNA, the valid combinations they miss are then
+    # taken from a permutation of the combination space:
+    fill_from_permutation = enumerate_combinations and logic_sampler is not None
+    if fill_from_permutation:
+        enumerate_combinations = False
+        log.info(
+                f"\n - Collection size is {round(num_total / max(num_reachable, 1) * 100, 2)}% of the "
+                f"{num_reachable} combinations satisfying the Logic rules. DNA will be drawn with the "
+                f"{logic_mode.capitalize()} logic mode, then any valid combination it misses will be drawn without "
+                f"replacement."
+        )
+    elif enumerate_combinations:
+        log.info(
+                f"\n - Collection size is {round(num_total / max(num_reachable, 1) * 100, 2)}% of the "
+                f"{num_reachable} {'valid' if enable_logic and exact else 'possible'} combinations, DNA will be "
+                f"drawn without replacement."
+        )
+        # A single permutation of the combination space can't be split between workers without overlap:
+        workers = 1
+
+    shard_sizes = [num_to_generate // workers + (i < num_to_generate % workers) for i in range(workers)]
+    shard_args = [
+        dict(
+            hierarchy=hierarchy,
+            collection_size=shard_size,
+            enable_rarity=enable_rarity,
+            enable_logic=enable_logic,
+            logic_file=logic_file,
+            enable_materials=enable_materials,
+            materials_file=materials_file,
+            seed_sequence=shard_seed,
+            enumerate_combinations=enumerate_combinations,
+            saturation_limit=saturation_limit,
+            excluded_keys=existing_keys,
+            logic_program=logic_program,
+            logic_mode=logic_mode,
+            logic_sampler=logic_sampler,
+        ) for shard_size, shard_seed in zip(shard_sizes, shard_seeds)
+    ]
+
+    if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+        if loader is not None:
+            loader.stop()
+        log.info(f"\n - Generating DNA in {workers} worker processes.")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as executor:
+            futures = [executor.submit(generate_dna_matrix, **kwargs) for kwargs in shard_args]
+            shard_results = [future.result() for future in futures]
+    else:
+        if workers > 1:
+            log.info(f"\n - Worker processes are not available on this platform, shards will be generated in turn.")
+        shard_results = [generate_dna_matrix(**kwargs) for kwargs in shard_args]
+
+    # Merges shards in order, dropping DNA already drawn by an earlier shard:
+    sampler_stats = {
+        "num_drawn": 0,
+        "draws_without_new": 0,
+        "saturated": False,
+        "rule_counter": Counter(),
+        "logic_conflicts": Counter(),
+        "rule_stats": logic.RuleStats(),
+    }
+    dna_keys = set(existing_keys)
+    dna_rows = []
+
+    for shard_matrix, shard_stats in shard_results:
+        shard_keys = codec.keys(shard_matrix)
+        unique_rows = [j for j, key in enumerate(shard_keys) if not (key in dna_keys or dna_keys.add(key))]
+        dna_rows.append(shard_matrix[unique_rows])
+
+        sampler_stats["num_drawn"] += shard_stats["num_drawn"]
+        sampler_stats["draws_without_new"] = max(sampler_stats["draws_without_new"], shard_stats["draws_without_new"])
+        sampler_stats["saturated"] |= shard_stats["saturated"]
+        sampler_stats["rule_counter"].update(shard_stats["rule_counter"])
+        sampler_stats["logic_conflicts"].update(shard_stats["logic_conflicts"])
+        sampler_stats["rule_stats"].update(shard_stats["rule_stats"])
+
+    def top_up(num_missing, seed_sequence, enumerate_combinations):
+        """Draws num_missing more DNA unique against every DNA kept so far, and merges their statistics."""
+        top_up_args = dict(
+                shard_args[0],
+                collection_size=num_missing,
+                seed_sequence=seed_sequence,
+                enumerate_combinations=enumerate_combinations,
+                excluded_keys=dna_keys
+        )
+        top_up_matrix, top_up_stats = generate_dna_matrix(**top_up_args)
+        dna_keys.update(codec.keys(top_up_matrix))
+        dna_rows.append(top_up_matrix)
+
+        sampler_stats["num_drawn"] += top_up_stats["num_drawn"]
+        sampler_stats["draws_without_new"] = top_up_stats["draws_without_new"]
+        sampler_stats["saturated"] = top_up_stats["saturated"]
+        sampler_stats["rule_counter"].update(top_up_stats["rule_counter"])
+        sampler_stats["logic_conflicts"].update(top_up_stats["logic_conflicts"])
+        sampler_stats["rule_stats"].update(top_up_stats["rule_stats"])
+
+    if num_total > len(dna_keys) and not enumerate_combinations and not sampler_stats["saturated"]:
+        top_up(num_total - len(dna_keys), shard_seeds[-1], False)
+
+    if num_total > len(dna_keys) and fill_from_permutation:
+        top_up(num_total - len(dna_keys), seed_sequence.spawn(1)[0], True)
+
+    # Drawing only stops short of the collection on saturation, or once every combination has been enumerated:
+    if num_total > len(dna_keys) and not sampler_stats["saturated"]:
+        log.warning(
+                f"\n{TextColors.WARNING}Blend_My_NFTs Warning:\n"
+                f"Every combination your Rarity and Logic settings allow was drawn, and only "
+                f"{len(dna_keys) - len(existing_keys)} new unique DNA were found. {num_total - len(dna_keys)} DNA are "
+                f"missing from the collection.{TextColors.RESET}"
+        )
+
+    dna_matrix = np.concatenate(dna_rows) if dna_rows else codec.empty_rows(0)
+
+    def create_dna_list(dna_matrix):
+        """Creates dna_list, the DNA strings of dna_matrix formatted for NFTRecord.json."""
         dna_list_formatted = []
-        dna_counter = 1
-        for i in dna_list_non_formatted:
+        dna_counter = len(existing_dna) + 1
+        for i in codec.dna_from_rows(dna_matrix):
             dna_list_formatted.append({
                 i: {
                     "complete": False,
@@ -164,27 +469,65 @@ def generate_nft_dna(
 
         return dna_list_formatted
 
-    dna_list = create_dna_list()
+    dna_list = create_dna_list(dna_matrix)
+
+    saturation_report = create_saturation_report(codec, attribute_sampler, dna_matrix, sampler_stats)
 
-    helpers.raise_warning_collection_size(dna_list, collection_size)
+    for rules, count in sampler_stats["logic_conflicts"].most_common():
+        log.warning(
+                f"\n{TextColors.WARNING}Blend_My_NFTs Warning:\n"
+                f"Logic rules {' and '.join(rules)} undo each other, {count} drawn DNA could not be repaired and were "
+                f"drawn again. Review these rules, or use the Constraint logic mode.{TextColors.RESET}"
+        )
+    log.debug(saturation_report)
+    helpers.raise_warning_collection_size(dna_list, collection_size, saturation_report)
+
+    if enable_logic and logic_stats_path:
+        save_logic_stats(sampler_stats["rule_stats"], hierarchy, logic_stats_path)
 
     # Data stored in batchDataDictionary:
     data_dictionary["num_nfts_generated"] = len(dna_list)
     data_dictionary["hierarchy"] = hierarchy
     data_dictionary["dna_list"] = dna_list
 
-    return data_dictionary
+    return data_dictionary, dna_matrix
+
+
+def save_logic_stats(rule_stats, hierarchy, save_path):
+    """
+    Saves the profile of each Logic rule (see logic.RuleStats) to LogicStats.json in save_path, next to RarityData.json,
+    and logs the rules that took the most time and rewrote the most DNA.
+    """
+    logic_stats = rule_stats.as_dict(hierarchy)
+    profiles = [
+        (f"{name} {rule_type}", profile) for name in logic_stats for rule_type, profile in logic_stats[name].items()
+    ]
+
+    report = f"\nLogic rules by time spent:"
+    for rule, profile in sorted(profiles, key=lambda item: -item[1]["seconds"]):
+        report += (
+            f"\n - {rule}: {profile['seconds']}s, {profile['evaluations']} evaluations, {profile['violations']} "
+            f"violations, {profile['rewrites']} DNA rewritten."
+        )
+    log.info(report)
+
+    path = os.path.join(save_path, "LogicStats.json")
+    with open(path, 'w') as outfile:
+        outfile.write(json.dumps(logic_stats, indent=1, ensure_ascii=True) + '\n')
+
+    log.info(f"\nLogic rule statistics have been saved to:\n{path}")
 
 
 def make_batches(
-        collection_size,
+        dna_list,
+        hierarchy,
         nfts_per_batch,
-        save_path,
         batch_json_save_path
 ):
     """
-    Sorts through all the batches and outputs a given number of batches depending on collection_size and nfts_per_batch.
-    These files are then saved as Batch#.json files to batch_json_save_path
+    Splits dna_list into contiguous Batches of nfts_per_batch DNA, the last Batch holding the remainder. These files are
+    then saved as Batch#.json files to batch_json_save_path, next to a single Hierarchy.json file that every Batch
+    references instead of holding its own copy of the hierarchy.
     """
 
     # Clears the Batch Data folder of Batches:
@@ -197,15 +540,8 @@ def make_batches(
                     os.path.join(batch_json_save_path, i)
                 )
 
-    blend_my_nf_ts_output = os.path.join(save_path, "Blend_My_NFTs Output", "NFT_Data")
-    nft_record_save_path = os.path.join(blend_my_nf_ts_output, "NFTRecord.json")
-    data_dictionary = json.load(open(nft_record_save_path))
-
-    hierarchy = data_dictionary["hierarchy"]
-    dna_list = data_dictionary["dna_list"]
-
-    num_batches = collection_size // nfts_per_batch
-    remainder_dna = collection_size % nfts_per_batch
+    num_batches = len(dna_list) // nfts_per_batch
+    remainder_dna = len(dna_list) % nfts_per_batch
     if remainder_dna > 0:
         num_batches += 1
 
@@ -214,27 +550,63 @@ def make_batches(
             f"operate normally."
     )
 
-    batches_dna_list = []
+    save_hierarchy(hierarchy, batch_json_save_path)
 
     for i in range(num_batches):
-        if i != range(num_batches)[-1]:
-            batch_dna_list = list(dna_list[0:nfts_per_batch])
-            batches_dna_list.append(batch_dna_list)
+        save_batch_file(dna_list[i * nfts_per_batch:(i + 1) * nfts_per_batch], i + 1, batch_json_save_path)
+
+
+def append_batches(
+        dna_list,
+        hierarchy,
+        nfts_per_batch,
+        batch_json_save_path
+):
+    """
+    Saves dna_list as new Batch#.json files of nfts_per_batch DNA, numbered after the last Batch already in
+    batch_json_save_path. Existing Batches are left untouched.
+    """
+
+    batch_numbers = [
+        int(i[len("Batch"):-len(".json")]) for i in os.listdir(batch_json_save_path)
+        if i.startswith("Batch") and i.endswith(".json") and i[len("Batch"):-len(".json")].isdigit()
+    ]
+    last_batch = max(batch_numbers, default=0)
+
+    num_batches = -(-len(dna_list) // nfts_per_batch)
+    log.info(
+            f"\nGenerating {num_batches} new batch files after Batch{last_batch}.json."
+    )
+
+    if not os.path.exists(os.path.join(batch_json_save_path, HIERARCHY_FILE_NAME)):
+        save_hierarchy(hierarchy, batch_json_save_path)
+
+    for i in range(num_batches):
+        save_batch_file(
+                dna_list[i * nfts_per_batch:(i + 1) * nfts_per_batch], last_batch + i + 1, batch_json_save_path
+        )
 
-            dna_list = [x for x in dna_list if x not in batch_dna_list]
-        else:
-            batch_dna_list = dna_list
 
-        batch_dictionary = {
-            "nfts_in_batch": int(len(batch_dna_list)),
-            "hierarchy": hierarchy,
-            "batch_dna_list": batch_dna_list
-        }
+def save_hierarchy(hierarchy, batch_json_save_path):
+    """Saves the hierarchy shared by all Batch#.json files to Hierarchy.json in batch_json_save_path."""
+    hierarchy = json.dumps(hierarchy, indent=1, ensure_ascii=True)
 
-        batch_dictionary = json.dumps(batch_dictionary, indent=1, ensure_ascii=True)
+    with open(os.path.join(batch_json_save_path, HIERARCHY_FILE_NAME), "w") as outfile:
+        outfile.write(hierarchy)
 
-        with open(os.path.join(batch_json_save_path, f"Batch{i + 1}.json"), "w") as outfile:
-            outfile.write(batch_dictionary)
+
+def save_batch_file(batch_dna_list, batch_number, batch_json_save_path):
+    """Saves a list of DNA as Batch#.json in batch_json_save_path."""
+    batch_dictionary = {
+        "nfts_in_batch": int(len(batch_dna_list)),
+        "hierarchy_file": HIERARCHY_FILE_NAME,
+        "batch_dna_list": batch_dna_list
+    }
+
+    batch_dictionary = json.dumps(batch_dictionary, indent=1, ensure_ascii=True)
+
+    with open(os.path.join(batch_json_save_path, f"Batch{batch_number}.json"), "w") as outfile:
+        outfile.write(batch_dictionary)
 
 
 def send_to_record(
@@ -249,7 +621,10 @@ def send_to_record(
         blend_my_nfts_output,
         batch_json_save_path,
         enable_debug,
-        log_path
+        log_path,
+        seed=None,
+        workers=1,
+        logic_mode="REPAIR"
 ):
     """
    Creates NFTRecord.json file and sends "batch_data_dictionary" to it. NFTRecord.json is a permanent record of all DNA
@@ -283,6 +658,13 @@ def send_to_record(
                 f"\n - Logic is ON. {len(list(logic_file.keys()))} rules detected, implementation will "
                 f"be attempted."
         )
+        if logic_mode == "CONSTRAINT":
+            log.info(f"\n - Logic mode is Constraint. DNA will be drawn from the Variants allowed by the rules.")
+        elif logic_mode == "CONDITIONAL":
+            log.info(
+                    f"\n - Logic mode is Conditional. DNA will be drawn from the combinations allowed by the rules, "
+                    f"weighted to keep the rarity of each Variant."
+            )
 
     if enable_materials:
         log.info(
@@ -293,13 +675,18 @@ def send_to_record(
 
     def create_nft_data():
         try:
-            data_dictionary = generate_nft_dna(
+            data_dictionary, dna_matrix = generate_nft_dna(
                     collection_size,
                     enable_rarity,
                     enable_logic,
                     logic_file,
                     enable_materials,
                     materials_file,
+                    seed,
+                    workers,
+                    logic_mode=logic_mode,
+                    logic_stats_path=os.path.join(save_path, "Blend_My_NFTs Output/NFT_Data"),
+                    loader=loading
             )
             nft_record_save_path = os.path.join(blend_my_nfts_output, "NFTRecord.json")
 
@@ -309,7 +696,7 @@ def send_to_record(
             helpers.raise_error_zero_combinations()
 
             if enable_rarity:
-                helpers.check_rarity(data_dictionary["hierarchy"], data_dictionary["dna_list"],
+                helpers.check_rarity(data_dictionary["hierarchy"], dna_matrix,
                                      os.path.join(save_path, "Blend_My_NFTs Output/NFT_Data"))
 
         except FileNotFoundError:
@@ -346,10 +733,12 @@ def send_to_record(
             )
             raise
 
+        return data_dictionary
+
     # Loading Animation:
     loading = helpers.Loader(f'\nCreating NFT DNA...', '').start()
-    create_nft_data()
-    make_batches(collection_size, nfts_per_batch, save_path, batch_json_save_path)
+    data_dictionary = create_nft_data()
+    make_batches(data_dictionary["dna_list"], data_dictionary["hierarchy"], nfts_per_batch, batch_json_save_path)
     loading.stop()
 
     time_end = time.time()
@@ -357,3 +746,124 @@ def send_to_record(
     log.info(
         f"\n{TextColors.OK}TIME [Created and Saved NFT data]: {time_end - time_start}s.\n{TextColors.RESET}"
     )
+
+
+def extend_record(
+        collection_size,
+        nfts_per_batch,
+        save_path,
+        enable_rarity,
+        enable_logic,
+        logic_file,
+        enable_materials,
+        materials_file,
+        blend_my_nfts_output,
+        batch_json_save_path,
+        enable_debug,
+        log_path,
+        seed=None,
+        workers=1,
+        logic_mode="REPAIR"
+):
+    """
+    Extends the existing NFTRecord.json to collection_size DNA. Only the additional DNA are generated, unique against
+    the DNA already in the record, and appended with continuing order_num. They are saved to new Batch#.json files, so
+    Batches that were already generated or rendered are never rewritten.
+    """
+
+    nft_record_save_path = os.path.join(blend_my_nfts_output, "NFTRecord.json")
+
+    if not os.path.exists(nft_record_save_path):
+        log.error(
+                f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
+                f"No NFTRecord.json found in {blend_my_nfts_output}. Create NFT Data before extending it. For more "
+                f"information, see:\n{TextColors.RESET}"
+                f"https://github.com/torrinworx/Blend_My_NFTs#blender-file-organization-and-structure\n"
+        )
+        raise FileNotFoundError(nft_record_save_path)
+
+    data_dictionary = json.load(open(nft_record_save_path))
+    existing_dna = [list(i.keys())[0] for i in data_dictionary["dna_list"]]
+
+    # New DNA are only unique against existing DNA if both were made from the same Attributes and Variants:
+    helpers.check_scene()
+    if helpers.get_hierarchy() != data_dictionary["hierarchy"]:
+        log.error(
+                f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
+                f"The Attributes or Variants of your scene changed since NFTRecord.json was created. The collection "
+                f"can't be extended, Create NFT Data again instead. For more information, see:\n{TextColors.RESET}"
+                f"https://github.com/torrinworx/Blend_My_NFTs#blender-file-organization-and-structure\n"
+        )
+        raise ValueError("The scene hierarchy doesn't match the hierarchy in NFTRecord.json.")
+
+    if existing_dna and (":" in existing_dna[0]) != bool(enable_materials):
+        log.error(
+                f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
+                f"NFTRecord.json was created with Materials {'ON' if ':' in existing_dna[0] else 'OFF'}. Extend it "
+                f"with the same Materials setting.\n{TextColors.RESET}"
+        )
+        raise ValueError("The Materials setting doesn't match NFTRecord.json.")
+
+    num_new = collection_size - len(existing_dna)
+    if num_new <= 0:
+        log.info(
+                f"\n{TextColors.OK}NFTRecord.json already holds {len(existing_dna)} DNA, nothing to extend to a "
+                f"collection of {collection_size}.{TextColors.RESET}"
+        )
+        return
+
+    log.info(
+            f"\n{TextColors.OK}======== Extending NFT Data ({len(existing_dna)} + {num_new} DNA) ========"
+            f"{TextColors.RESET}"
+    )
+    time_start = time.time()
+
+    loading = helpers.Loader(f'\nCreating NFT DNA...', '').start()
+    try:
+        new_data_dictionary, dna_matrix = generate_nft_dna(
+                num_new,
+                enable_rarity,
+                enable_logic,
+                logic_file,
+                enable_materials,
+                materials_file,
+                seed,
+                workers,
+                existing_dna,
+                logic_mode,
+                logic_stats_path=os.path.join(save_path, "Blend_My_NFTs Output/NFT_Data"),
+                loader=loading
+        )
+    finally:
+        loading.stop()
+
+    data_dictionary["dna_list"] += new_data_dictionary["dna_list"]
+    data_dictionary["num_nfts_generated"] = len(data_dictionary["dna_list"])
+
+    # Checks:
+    helpers.raise_warning_max_nfts(nfts_per_batch, collection_size)
+    helpers.check_duplicates(data_dictionary["dna_list"])
+
+    if enable_rarity:
+        materials = json.load(open(materials_file)) if enable_materials else None
+        codec = dna_codec.DNACodec(data_dictionary["hierarchy"], materials)
+        full_matrix = np.concatenate([codec.rows_from_dna(existing_dna), dna_matrix])
+        helpers.check_rarity(data_dictionary["hierarchy"], full_matrix,
+                             os.path.join(save_path, "Blend_My_NFTs Output/NFT_Data"))
+
+    ledger = json.dumps(data_dictionary, indent=1, ensure_ascii=True)
+    with open(nft_record_save_path, 'w') as outfile:
+        outfile.write(ledger + '\n')
+
+    log.info(
+            f"\n{TextColors.OK}{len(new_data_dictionary['dna_list'])} new NFT data successfully added to:"
+            f"\n{nft_record_save_path}{TextColors.RESET}"
+    )
+
+    append_batches(new_data_dictionary["dna_list"], data_dictionary["hierarchy"], nfts_per_batch, batch_json_save_path)
+
+    time_end = time.time()
+
+    log.info(
+        f"\n{TextColors.OK}TIME [Extended and Saved NFT data]: {time_end - time_start}s.\n{TextColors.RESET}"
+    )
@@ -14,6 +14,7 @@ import platform
 import traceback
 
 from .helpers import TextColors, Loader
+from .dna_codec import DNACodec
 from .metadata_templates import create_cardano_metadata, createSolanaMetaData, create_erc721_meta_data
 
 log = logging.getLogger(__name__)
@@ -123,6 +124,101 @@ def save_completed(full_single_dna, a, x, batch_json_save_path, batch_to_generat
     save_batch(batch, file_name)
 
 
+def get_material_plan(codec, dna_rows, materials_file):
+    """
+    Returns the Material plan of a Batch: each (Variant, Material number) pair selected by a DNA row of dna_rows mapped
+    to the name of the Material, the objects it is applied to and the Material itself. Objects and Materials are looked
+    up in bpy.data once per Batch instead of once per NFT. Objects are the 'Variant Objects' of the Variant in
+    materials_file, or every object of the Variant collection if none are listed.
+    """
+    plan = {}
+    variant_objects = {}
+    for row in dna_rows:
+        for i in range(codec.num_attributes):
+            material_num = int(row[codec.num_attributes + i])
+            if not material_num:
+                continue
+
+            variant = codec.variants[i][row[i] - 1]
+            if (variant, material_num) in plan:
+                continue
+
+            material_name = codec.material_lists[variant][material_num - 1]
+            try:
+                if variant not in variant_objects:
+                    if materials_file[variant]['Variant Objects']:
+                        variant_objects[variant] = [
+                            bpy.data.objects[obj] for obj in materials_file[variant]['Variant Objects']
+                        ]
+                    else:
+                        variant_objects[variant] = list(bpy.data.collections[variant].all_objects)
+
+                plan[(variant, material_num)] = (
+                    material_name, variant_objects[variant], bpy.data.materials[material_name]
+                )
+            except KeyError:
+                log.error(
+                        f"\n{traceback.format_exc()}"
+                        f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
+                        f"The Material '{material_name}' of the Variant '{variant}', or one of its Variant Objects, "
+                        f"appears to be missing or has been renamed. Ensure your materials file matches your .blend "
+                        f"file scene. For more information see:{TextColors.RESET}"
+                        f"\nhttps://github.com/torrinworx/Blend_My_NFTs#randomizing-materials\n"
+                )
+                raise
+
+    return plan
+
+
+def apply_material_plan(material_plan, codec, dna_row):
+    """
+    Applies the Materials of dna_row using the Material plan of its Batch, see get_material_plan(). Objects that
+    already have the selected Material are left untouched. Returns the Material name of each Variant with a Material.
+    """
+    metadata_material_dict = {}
+    for i in range(codec.num_attributes):
+        material_num = int(dna_row[codec.num_attributes + i])
+        if not material_num:
+            continue
+
+        variant = codec.variants[i][dna_row[i] - 1]
+        material_name, objects, material = material_plan[(variant, material_num)]
+        metadata_material_dict[variant] = material_name
+        for obj in objects:
+            if obj.active_material != material:
+                obj.active_material = material
+
+    return metadata_material_dict
+
+
+def get_variant_collections(hierarchy):
+    """Returns a dictionary of each Variant collection name in hierarchy and its collection in bpy.data."""
+    variant_collections = {}
+    for i in hierarchy:
+        for j in hierarchy[i]:
+            try:
+                variant_collections[j] = bpy.data.collections[j]
+            except KeyError:
+                log.error(
+                        f"\n{traceback.format_exc()}"
+                        f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
+                        f"The Collection '{j}' appears to be missing or has been renamed. If you made any changes "
+                        f"to your .blend file scene, ensure you re-create your NFT Data so Blend_My_NFTs can read "
+                        f"your scene. For more information see:{TextColors.RESET}"
+                        f"\nhttps://github.com/torrinworx/Blend_My_NFTs#blender-file-organization-and-structure\n"
+                )
+                raise TypeError()
+    return variant_collections
+
+
+def set_collection_visible(collection, visible):
+    """Shows or hides a collection in renders and in the viewport, only writing the properties that change."""
+    if collection.hide_render == visible:
+        collection.hide_render = not visible
+    if collection.hide_viewport == visible:
+        collection.hide_viewport = not visible
+
+
 # Exporter functions:
 def get_batch_data(batch_to_generate, batch_json_save_path):
     """
@@ -133,9 +229,14 @@ def get_batch_data(batch_to_generate, batch_json_save_path):
     batch = json.load(open(file_name))
 
     nfts_in_batch = batch["nfts_in_batch"]
-    hierarchy = batch["hierarchy"]
     batch_dna_list = batch["batch_dna_list"]
 
+    # Batches reference the hierarchy file shared by all Batches, older Batches hold their own copy:
+    if "hierarchy" in batch:
+        hierarchy = batch["hierarchy"]
+    else:
+        hierarchy = json.load(open(os.path.join(batch_json_save_path, batch["hierarchy_file"])))
+
     return nfts_in_batch, hierarchy, batch_dna_list
 
 
@@ -169,117 +270,36 @@ def render_and_save_nfts(input, start_frame=None, end_frame=None):
 
     if input.enable_materials:
         materials_file = json.load(open(input.materials_file))
+        codec = DNACodec(hierarchy, materials_file)
+    else:
+        codec = DNACodec(hierarchy)
 
-    for a in batch_dna_list:
-        full_single_dna = list(a.keys())[0]
-        order_num_offset = input.order_num_offset
-        order_num = a[full_single_dna]['order_num'] + order_num_offset
-
-        # Material handling:
-        if input.enable_materials:
-            single_dna, material_dna = full_single_dna.split(':')
-
-        if not input.enable_materials:
-            single_dna = full_single_dna
-
-        def match_dna_to_variant(single_dna):
-            """
-            Matches each DNA number separated by "-" to its attribute, then its variant.
-            """
-
-            list_attributes = list(hierarchy.keys())
-            list_dna_deconstructed = single_dna.split('-')
-            dna_dictionary = {}
-
-            for i, j in zip(list_attributes, list_dna_deconstructed):
-                dna_dictionary[i] = j
-
-            for x in dna_dictionary:
-                for k in hierarchy[x]:
-                    k_num = hierarchy[x][k]["number"]
-                    if k_num == dna_dictionary[x]:
-                        dna_dictionary.update({x: k})
-            return dna_dictionary
-
-        def match_material_dna_to_material(single_dna, material_dna, materials_file):
-            """
-            Matches the Material DNA to it's selected Materials unless a 0 is present meaning no material for that variant was selected.
-            """
-            list_attributes = list(hierarchy.keys())
-            list_dna_deconstructed = single_dna.split('-')
-            list_material_dna_deconstructed = material_dna.split('-')
-
-            full_dna_dict = {}
-
-            for attribute, variant, material in zip(
-                    list_attributes,
-                    list_dna_deconstructed,
-                    list_material_dna_deconstructed
-            ):
-
-                for var in hierarchy[attribute]:
-                    if hierarchy[attribute][var]['number'] == variant:
-                        variant = var
-
-                if material != '0':  # If material is not empty
-                    for variant_m in materials_file:
-                        if variant == variant_m:
-                            # Getting Materials name from Materials index in the Materials List
-                            materials_list = list(materials_file[variant_m]["Material List"].keys())
+    # Each DNA string is decoded once, Variants and Materials are then read from its compact row:
+    dna_rows = codec.rows_from_dna([list(a.keys())[0] for a in batch_dna_list])
 
-                            material = materials_list[int(material) - 1]  # Subtract 1 because '0' means empty mat
-                            break
+    # Objects and Materials of the Batch are resolved once, before the first NFT:
+    if input.enable_materials:
+        material_plan = get_material_plan(codec, dna_rows, materials_file)
 
-                full_dna_dict[variant] = material
+    # Turn off render camera and viewport camera for all collections in hierarchy, once per Batch. Each NFT then only
+    # toggles the collections that differ from the previous NFT, every write to a collection updating the depsgraph:
+    variant_collections = get_variant_collections(hierarchy)
+    for collection in variant_collections.values():
+        set_collection_visible(collection, False)
+    visible_collections = set()
 
-            return full_dna_dict
+    for a, dna_row in zip(batch_dna_list, dna_rows):
+        full_single_dna = list(a.keys())[0]
+        order_num_offset = input.order_num_offset
+        order_num = a[full_single_dna]['order_num'] + order_num_offset
 
         metadata_material_dict = {}
 
         if input.enable_materials:
-            material_dna_dictionary = match_material_dna_to_material(single_dna, material_dna, materials_file)
-
-            for var_mat in list(material_dna_dictionary.keys()):
-                if material_dna_dictionary[var_mat]!='0':
-                    if not materials_file[var_mat]['Variant Objects']:
-                        """
-                        If objects to apply material to not specified, apply to all objects in Variant collection.
-                        """
-                        metadata_material_dict[var_mat] = material_dna_dictionary[var_mat]
-
-                        for obj in bpy.data.collections[var_mat].all_objects:
-                            selected_object = bpy.data.objects.get(obj.name)
-                            selected_object.active_material = bpy.data.materials[material_dna_dictionary[var_mat]]
-
-                    if materials_file[var_mat]['Variant Objects']:
-                        """
-                        If objects to apply material to are specified, apply material only to objects specified withing 
-                        the Variant collection.
-                        """
-                        metadata_material_dict[var_mat] = material_dna_dictionary[var_mat]
-
-                        for obj in materials_file[var_mat]['Variant Objects']:
-                            selected_object = bpy.data.objects.get(obj)
-                            selected_object.active_material = bpy.data.materials[material_dna_dictionary[var_mat]]
-
-        # Turn off render camera and viewport camera for all collections in hierarchy
-        for i in hierarchy:
-            for j in hierarchy[i]:
-                try:
-                    bpy.data.collections[j].hide_render = True
-                    bpy.data.collections[j].hide_viewport = True
-                except KeyError:
-                    log.error(
-                            f"\n{traceback.format_exc()}"
-                            f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
-                            f"The Collection '{j}' appears to be missing or has been renamed. If you made any changes "
-                            f"to your .blend file scene, ensure you re-create your NFT Data so Blend_My_NFTs can read "
-                            f"your scene. For more information see:{TextColors.RESET}"
-                            f"\nhttps://github.com/torrinworx/Blend_My_NFTs#blender-file-organization-and-structure\n"
-                    )
-                    raise TypeError()
-
-        dna_dictionary = match_dna_to_variant(single_dna)
+            material_dna_dictionary = codec.material_names(dna_row)
+            metadata_material_dict = apply_material_plan(material_plan, codec, dna_row)
+
+        dna_dictionary = codec.variant_names(dna_row)
         name = input.nft_name + "_" + str(order_num)
 
         # Change Text Object in Scene to match DNA string:
@@ -300,11 +320,13 @@ def render_and_save_nfts(input, start_frame=None, end_frame=None):
 
         log.info(f"\nDNA Code:{full_single_dna}")
 
-        for c in dna_dictionary:
-            collection = dna_dictionary[c]
-            if collection != '0':
-                bpy.data.collections[collection].hide_render = False
-                bpy.data.collections[collection].hide_viewport = False
+        # Only the collections that differ from the previous NFT are shown or hidden:
+        selected_collections = {collection for collection in dna_dictionary.values() if collection != '0'}
+        for collection in visible_collections - selected_collections:
+            set_collection_visible(variant_collections[collection], False)
+        for collection in selected_collections - visible_collections:
+            set_collection_visible(variant_collections[collection], True)
+        visible_collections = selected_collections
 
         time_start_2 = time.time()
 
@@ -596,10 +618,8 @@ def render_and_save_nfts(input, start_frame=None, end_frame=None):
 
         x += 1
 
-    for i in hierarchy:
-        for j in hierarchy[i]:
-            bpy.data.collections[j].hide_render = False
-            bpy.data.collections[j].hide_viewport = False
+    for collection in variant_collections.values():
+        set_collection_visible(collection, True)
 
     batch_complete_time = time.time() - time_start_1
 
@@ -32,7 +32,7 @@ def get_python_args():
 
     parser.add_argument("--operation",
                         dest="operation",
-                        choices=['create-dna', 'generate-nfts', 'refactor-batches'],
+                        choices=['create-dna', 'extend-dna', 'audit-logic', 'generate-nfts', 'refactor-batches'],
                         required=True,
                         help="Choose which operation you want to perform"
                         )
@@ -86,4 +86,34 @@ def get_python_args():
                         help="project end frame"
                         )
 
+    parser.add_argument("--logic-mode",
+                        dest="logic_mode",
+                        choices=['repair', 'constraint', 'conditional'],
+                        required=False,
+                        help="Overwrite the Logic mode, repair drawn DNA, only draw DNA allowed by the rules, or draw "
+                             "them keeping the rarity of each Variant"
+                        )
+
+    parser.add_argument("--repair",
+                        dest="repair",
+                        action="store_true",
+                        required=False,
+                        help="With audit-logic, repair the DNA that break the Logic rules in place"
+                        )
+
+    parser.add_argument("--seed",
+                        dest="seed",
+                        type=int,
+                        required=False,
+                        help="Seed for DNA generation, the same seed and workers always create the same DNA"
+                        )
+
+    parser.add_argument("--workers",
+                        dest="workers",
+                        type=int,
+                        default=1,
+                        required=False,
+                        help="Number of worker processes used to generate DNA, headless only"
+                        )
+
     return parser.parse_args(argv), parser
@@ -2,7 +2,6 @@ import bpy
 import os
 import sys
 import json
-import copy
 import logging
 import tempfile
 import platform
@@ -11,7 +10,10 @@ from time import sleep
 from itertools import cycle
 from threading import Thread
 from shutil import get_terminal_size
-from collections import Counter, defaultdict
+
+import numpy as np
+
+from . import dna_codec
 
 log = logging.getLogger(__name__)
 
@@ -75,12 +77,45 @@ def save_result(result):
 
 # This section retrieves the Scene hierarchy from the current Blender file.
 
+# The last hierarchy built by get_hierarchy() and the fingerprint of the collection tree it was built from:
+_hierarchy_cache = {"fingerprint": None, "hierarchy": None}
+
+
+def get_collection_fingerprint():
+    """
+    Returns a cheap fingerprint of the collection tree of the current scene, the name and child names of every
+    collection under the scene root. Attribute and Variant data is encoded in collection names, so the hierarchy only
+    changes when this fingerprint does.
+    """
+
+    def traverse_tree(t):
+        yield t
+        for child in t.children:
+            yield from traverse_tree(child)
+
+    fingerprint = tuple(
+        (c.name, tuple(child.name for child in c.children)) for c in traverse_tree(bpy.context.scene.collection)
+    )
+
+    script_ignore_collection = bpy.data.collections.get("Script_Ignore")
+    if script_ignore_collection is not None:
+        fingerprint += (tuple(c.name for c in traverse_tree(script_ignore_collection)),)
+
+    return fingerprint
+
 
 def get_hierarchy():
     """
     Returns the hierarchy of a given Blender scene.
+
+    The hierarchy is cached until the collection tree of the scene changes, see get_collection_fingerprint(). Every
+    call returns the same dictionary, callers must not modify it.
     """
 
+    fingerprint = get_collection_fingerprint()
+    if _hierarchy_cache["fingerprint"] == fingerprint:
+        return _hierarchy_cache["hierarchy"]
+
     coll = bpy.context.scene.collection
 
     script_ignore_collection = bpy.data.collections["Script_Ignore"]
@@ -120,22 +155,11 @@ def get_hierarchy():
     list_all_collections.sort()
 
     exclude = ["_"]  # Excluding characters that identify a Variant
-    attribute_collections = copy.deepcopy(list_all_collections)
 
-    def filter_num():
-        """
-        This function removes items from 'attribute_collections' if they include values from the 'exclude' variable.
-        It removes child collections from the parent collections in from the "list_all_collections" list.
-        """
-        for x in attribute_collections:
-            if any(i in x for i in exclude):
-                attribute_collections.remove(x)
-
-    for i in range(len(list_all_collections)):
-        filter_num()
-
-    attribute_variants = [x for x in list_all_collections if x not in attribute_collections]
-    attribute_collections1 = copy.deepcopy(attribute_collections)
+    # Attribute collections are the ones whose name doesn't include any value from the 'exclude' variable, every other
+    # collection is a Variant:
+    attribute_collections = [x for x in list_all_collections if not any(i in x for i in exclude)]
+    attribute_variants = [x for x in list_all_collections if any(i in x for i in exclude)]
 
     def attribute_data(att_vars):
         """
@@ -174,18 +198,11 @@ def get_hierarchy():
     variant_meta_data = attribute_data(attribute_variants)
 
     hierarchy = {}
-    for i in attribute_collections1:
-        col_par_long = list(bpy.data.collections[str(i)].children)
-        col_par_short = {}
-        for x in col_par_long:
-            col_par_short[x.name] = None
-        hierarchy[i] = col_par_short
-
-    for a in hierarchy:
-        for b in hierarchy[a]:
-            for x in variant_meta_data:
-                if str(x) == str(b):
-                    (hierarchy[a])[b] = variant_meta_data[x]
+    for i in attribute_collections:
+        hierarchy[i] = {x.name: variant_meta_data.get(x.name) for x in bpy.data.collections[str(i)].children}
+
+    _hierarchy_cache["fingerprint"] = fingerprint
+    _hierarchy_cache["hierarchy"] = hierarchy
 
     return hierarchy
 
@@ -194,19 +211,21 @@ def get_hierarchy():
 
 # This section is used to get the number of combinations for checks and the UI display
 
-def get_combinations():
+def get_combinations(hierarchy=None, materials=None):
     """
     Returns "combinations", the number of all possible NFT DNA for a given Blender scene formatted to BMNFTs conventions
-    combinations.
+    combinations. If materials, the loaded materials.json dictionary, is given, each Material of a Variant counts as a
+    distinct combination.
     """
 
-    hierarchy = get_hierarchy()
+    if hierarchy is None:
+        hierarchy = get_hierarchy()
     hierarchy_by_num = []
 
-    for i in hierarchy:
+    for i, material_counts in zip(hierarchy, dna_codec.get_material_counts(hierarchy, materials)):
         # Ignore Collections with nothing in them
         if len(hierarchy[i]) != 0:
-            hierarchy_by_num.append(len(hierarchy[i]))
+            hierarchy_by_num.append(sum(material_counts))
         else:
             log.warning(f"\nThe following collection has been identified as empty: {i}")
 
@@ -257,45 +276,23 @@ def check_scene():  # Not complete
     # attribute_naming_conventions
 
 
-def check_rarity(hierarchy, dna_list_formatted, save_path):
-    """Checks rarity percentage of each Variant, then sends it to RarityData.json in NFT_Data folder."""
-
-    dna_list = [list(i.keys())[0] for i in dna_list_formatted]
-    num_nfts_generated = len(dna_list)
-    num_dict = defaultdict(list)
-    hierarchy.keys()
-
-    for i in dna_list:
-        dna_split_list = i.split("-")
-
-        for j, k in zip(dna_split_list, hierarchy.keys()):
-            num_dict[k].append(j)
-
-    num_dict = dict(num_dict)
-
-    for i in num_dict:
-        count = dict(Counter(num_dict[i]))
-        num_dict[i] = count
-
-    full_num_name = {}
-
-    for i in hierarchy:
-        full_num_name[i] = {}
-        for j in hierarchy[i]:
-            variant_num = hierarchy[i][j]["number"]
-
-            full_num_name[i][variant_num] = j
+def check_rarity(hierarchy, dna_matrix, save_path):
+    """
+    Checks rarity percentage of each Variant from the compact DNA matrix (see dna_codec.py), then sends it to
+    RarityData.json in NFT_Data folder.
+    """
 
+    num_nfts_generated = len(dna_matrix)
     complete_data = {}
 
-    for i, j in zip(full_num_name, num_dict):
+    for column, i in enumerate(hierarchy):
+        variant_counts = np.bincount(dna_matrix[:, column], minlength=len(hierarchy[i]) + 1)
+
         x = {}
-        for k in full_num_name[i]:
-            for l in num_dict[j]:
-                if l == k:
-                    name = full_num_name[i][k]
-                    num = num_dict[j][l]
-                    x[name] = [(str(round(((num / num_nfts_generated) * 100), 2)) + "%"), str(num)]
+        for position, name in enumerate(hierarchy[i], start=1):
+            num = int(variant_counts[position])
+            if num:
+                x[name] = [(str(round(((num / num_nfts_generated) * 100), 2)) + "%"), str(num)]
 
         complete_data[i] = x
 
@@ -357,6 +354,9 @@ def check_failed_batches(batch_json_save_path):
         batch_folders = remove_file_by_extension(os.listdir(batch_json_save_path))
 
         for i in batch_folders:
+            if not (i.startswith("Batch") and i.endswith(".json")):  # Skips the shared Hierarchy.json file
+                continue
+
             batch = json.load(open(os.path.join(batch_json_save_path, i)))
             nfts_in_batch = batch["nfts_in_batch"]
             if "Generation Save" in batch:
@@ -436,9 +436,10 @@ def raise_warning_max_nfts(nfts_per_batch, collection_size):
         raise ValueError()
 
 
-def raise_warning_collection_size(dna_list, collection_size):
+def raise_warning_collection_size(dna_list, collection_size, saturation_report=""):
     """
-    Prints warning if BMNFTs cannot generate requested number of NFTs from a given collection_size.
+    Prints warning if BMNFTs cannot generate requested number of NFTs from a given collection_size. saturation_report
+    is the summary of the DNA sampler explaining what limited the number of DNA generated, if any.
     """
 
     if len(dna_list) < collection_size:
@@ -455,6 +456,7 @@ def raise_warning_collection_size(dna_list, collection_size):
                 f"https://github.com/torrinworx/Blend_My_NFTs#logic).\n "
                 f"\n  c) The number of possible combinations of your NFT collection is too low. Add more Variants or "
                 f"Attributes to increase the recommended collection size.\n "
+                f"{saturation_report}"
                 f"\n{TextColors.RESET}"
         )
 
@@ -507,7 +509,11 @@ class Loader:
         self.start()
 
     def stop(self):
+        if self.done:
+            return
         self.done = True
+        if self._thread.is_alive():
+            self._thread.join()
         cols = get_terminal_size((80, 20)).columns
         print("\r" + " " * cols, end="", flush=True)
         print(f"\r{self.end}", flush=True)
@@ -3,7 +3,7 @@ import logging
 import bpy
 import json
 
-from main import dna_generator, exporter
+from main import dna_generator, exporter, auditor
 
 log = logging.getLogger(__name__)
 
@@ -11,7 +11,38 @@ log = logging.getLogger(__name__)
 #  process into one file.
 
 
-def send_to_record(input, reverse_order=False):
+# The last rules parsed by get_ui_logic_file() and the Logic UIList entries they were parsed from:
+_ui_logic_file_cache = {"entries": None, "logic_file": None}
+
+
+def get_ui_logic_file(scn, reverse_order=False):
+    """
+    Returns the rules of the Logic UIList of scn in the format of Logic.json. The rules are only parsed again when the
+    UIList entries change, every call with the same entries returns the same dictionary, callers must not modify it.
+    """
+    if reverse_order:
+        items = [scn.logic_fields[i] for i in range(scn.logic_fields_index, -1, -1)]
+    else:
+        items = list(scn.logic_fields)
+
+    entries = tuple((item.item_list1, item.rule_type, item.item_list2) for item in items)
+    if entries == _ui_logic_file_cache["entries"]:
+        return _ui_logic_file_cache["logic_file"]
+
+    logic_file = {}
+    for num, (item_list1, rule_type, item_list2) in enumerate(entries, start=1):
+        logic_file[f"Rule-{num}"] = {
+            "IF": item_list1.split(','),
+            rule_type: item_list2.split(',')
+        }
+
+    _ui_logic_file_cache["entries"] = entries
+    _ui_logic_file_cache["logic_file"] = logic_file
+    return logic_file
+
+
+def set_logic_file(input, reverse_order=False):
+    """Loads the Logic rules of input from Logic.json or the Logic UIList into input.logic_file."""
     if input.enable_logic:
         if input.enable_logic_json and input.logic_file:
             input.logic_file = json.load(open(input.logic_file))
@@ -23,33 +54,11 @@ def send_to_record(input, reverse_order=False):
             raise
 
         if not input.enable_logic_json:
-            scn = bpy.context.scene
-            if reverse_order:
-                input.logic_file = {}
-                num = 1
-                for i in range(scn.logic_fields_index, -1, -1):
-                    item = scn.logic_fields[i]
-
-                    item_list1 = item.item_list1
-                    rule_type = item.rule_type
-                    item_list2 = item.item_list2
-                    input.logic_file[f"Rule-{num}"] = {
-                        "IF": item_list1.split(','),
-                        rule_type: item_list2.split(',')
-                    }
-                    num += 1
-            else:
-                input.logic_file = {}
-                num = 1
-                for item in scn.logic_fields:
-                    item_list1 = item.item_list1
-                    rule_type = item.rule_type
-                    item_list2 = item.item_list2
-                    input.logic_file[f"Rule-{num}"] = {
-                        "IF": item_list1.split(','),
-                        rule_type: item_list2.split(',')
-                    }
-                    num += 1
+            input.logic_file = get_ui_logic_file(bpy.context.scene, reverse_order)
+
+
+def send_to_record(input, reverse_order=False):
+    set_logic_file(input, reverse_order)
 
     dna_generator.send_to_record(
             input.collection_size,
@@ -63,7 +72,52 @@ def send_to_record(input, reverse_order=False):
             input.blend_my_nfts_output,
             input.batch_json_save_path,
             input.enable_debug,
-            input.log_path
+            input.log_path,
+            input.seed,
+            input.workers,
+            input.logic_mode
+    )
+
+
+def extend_record(input, reverse_order=False):
+    set_logic_file(input, reverse_order)
+
+    dna_generator.extend_record(
+            input.collection_size,
+            input.nfts_per_batch,
+            input.save_path,
+            input.enable_rarity,
+            input.enable_logic,
+            input.logic_file,
+            input.enable_materials,
+            input.materials_file,
+            input.blend_my_nfts_output,
+            input.batch_json_save_path,
+            input.enable_debug,
+            input.log_path,
+            input.seed,
+            input.workers,
+            input.logic_mode
+    )
+
+
+def audit_record(input, repair=False, reverse_order=False):
+    if not input.enable_logic:
+        log.error(
+                f"Enable Logic to audit NFT Data against Logic rules."
+        )
+        raise ValueError()
+
+    set_logic_file(input, reverse_order)
+
+    auditor.audit_record(
+            input.enable_rarity,
+            input.logic_file,
+            input.materials_file if input.enable_materials else None,
+            input.blend_my_nfts_output,
+            input.batch_json_save_path,
+            repair,
+            input.seed
     )
 
 
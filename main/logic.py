@@ -2,377 +2,807 @@
 # The purpose of this file is to add logic and rules to the DNA that are sent to the NFTRecord.json file in
 # dna_generator.py
 
-import random
+import time
+import json
 import logging
-import traceback
+import difflib
 import collections
 
-from .helpers import TextColors
+import numpy as np
+
+from . import sampler
 
 log = logging.getLogger(__name__)
 
+RULE_TYPES = ("THEN", "NOT")
 
-def reconstruct_dna(deconstructed_dna):
-    reconstructed_dna = ""
-    for a in deconstructed_dna:
-        num = "-" + str(a)
-        reconstructed_dna += num
-    return ''.join(reconstructed_dna.split('-', 1))
 
+def get_mask_table(mask, num_variants):
+    """
+    Returns the lookup table of a bitmask of positions as a boolean array indexed by the positions 0 to num_variants,
+    so that a whole column of a DNA matrix can be tested against the bitmask with a single indexing operation.
+    """
+    return np.array([(mask >> position) & 1 for position in range(num_variants + 1)], dtype=bool)
 
-def get_var_info(variant, hierarchy):
-    # Get info for variant dict
-    name = variant.split("_")[0]
-    order_number = variant.split("_")[1]
-    rarity_number = variant.split("_")[2]
-    attribute = ""
 
-    for a in hierarchy:
-        for var in list(hierarchy[a].keys()):
-            if var == variant:
-                attribute = a
-                break
-    attribute_index = list(hierarchy.keys()).index(attribute)
+class CompiledRule:
+    """
+    A single IF/THEN or IF/NOT rule resolved against a hierarchy. Variants are identified by their 1 based position in
+    their Attribute, the same position used by DNA rows (see dna_codec.py), 0 being Empty. Each set of Variants of an
+    Attribute is stored as a bitmask of positions, so that checking a DNA row costs one shift per Attribute in the rule.
 
-    return [name, order_number, rarity_number, attribute, attribute_index]  # list of Var info sent back
+    rule_type "THEN": if a Variant of the IF list is selected, every Attribute of the THEN list must be one of its
+    Variants in the THEN list. Violations are repaired by selecting one of these Variants.
 
+    rule_type "NOT": if a Variant of the IF list is selected, no Variant of the NOT list may be selected. Violations are
+    repaired by selecting another Variant of the Attribute, or by setting the Attribute to Empty if the NOT list holds
+    the full Attribute.
+    """
 
-def logic_rarity(variant_list, enable_rarity, a):
-    number_list_of_i = []
-    rarity_list_of_i = []
-    if_zero_bool = None
-    variant_num = None
+    def __init__(self, name, rule_type, if_masks, result_masks, full_attributes, repair_choices):
+        self.name = name
+        self.rule_type = rule_type
+
+        # Lists of (attribute index, bitmask of positions):
+        self.if_masks = if_masks
+        self.result_masks = result_masks
+
+        # Attribute indices whose every Variant is in the THEN/NOT list:
+        self.full_attributes = full_attributes
+
+        # Attribute index -> (list of positions, AliasTable) a repair selects from, absent if it sets Empty:
+        self.repair_choices = repair_choices
+
+    def if_selected(self, values):
+        """True if a Variant of the IF list is selected in values, a DNA row as a list of positions."""
+        return any((mask >> values[i]) & 1 for i, mask in self.if_masks)
+
+    def is_violated(self, values):
+        """True if values, a DNA row as a list of positions, breaks this rule."""
+        if not self.if_selected(values):
+            return False
+
+        if self.rule_type == "THEN":
+            return any(not (mask >> values[i]) & 1 for i, mask in self.result_masks)
+        return any((mask >> values[i]) & 1 for i, mask in self.result_masks)
+
+    def selected_rows(self, matrix, num_variants):
+        """
+        Vectorized if_selected() over matrix, an N x Attributes array of DNA rows (extra Material columns are ignored).
+        Returns a boolean array of length N. num_variants is the number of Variants of each Attribute.
+        """
+        if_selected = np.zeros(len(matrix), dtype=bool)
+        for i, mask in self.if_masks:
+            if_selected |= get_mask_table(mask, num_variants[i])[matrix[:, i]]
+        return if_selected
+
+    def violated_rows(self, matrix, num_variants):
+        """Vectorized is_violated() over matrix, see selected_rows()."""
+        if_selected = self.selected_rows(matrix, num_variants)
+
+        broken = np.zeros(len(matrix), dtype=bool)
+        for i, mask in self.result_masks:
+            selected = get_mask_table(mask, num_variants[i])[matrix[:, i]]
+            broken |= ~selected if self.rule_type == "THEN" else selected
+
+        return if_selected & broken
+
+    def repair(self, values, rng):
+        """Changes the Attributes of values that break this rule, values must violate the rule."""
+        for i, mask in self.result_masks:
+            selected = (mask >> values[i]) & 1
+            if selected == (self.rule_type == "THEN"):
+                continue
 
-    for b in variant_list:
-        number = b.split("_")[1]
-        rarity = b.split("_")[2]
+            if i in self.repair_choices:
+                positions, alias_table = self.repair_choices[i]
+                values[i] = positions[alias_table.draw_one(rng)]
+            else:
+                values[i] = 0
 
-        number_list_of_i.append(int(number))
-        rarity_list_of_i.append(float(rarity))
 
-    for b in rarity_list_of_i:
-        if b == 0:
-            if_zero_bool = True
-        elif b != 0:
-            if_zero_bool = False
+class RuleStats:
+    """
+    Profile of the rules of a generation run. For each rule (keyed by rule name and rule type): the number of DNA it was
+    evaluated against, the number of violations found, the number of DNA it rewrote, the cumulative time spent
+    evaluating and repairing it, and the Variants its repairs selected. Each shard of a run fills its own RuleStats,
+    merged with update().
+    """
 
-    if enable_rarity:
-        try:
-            if if_zero_bool:
-                variant_num = random.choices(number_list_of_i, k=1)
-            elif not if_zero_bool:
-                variant_num = random.choices(number_list_of_i, weights=rarity_list_of_i, k=1)
-        except IndexError:
-            log.error(
-                f"\n{traceback.format_exc()}"
-                f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
-                f"An issue was found within the Attribute collection '{a}'. For more information on "
-                f"Blend_My_NFTs compatible scenes, see:\n{TextColors.RESET}"
-                f"https://github.com/torrinworx/Blend_My_NFTs#blender-file-organization-and-structure\n"
-            )
-            raise IndexError()
-    else:
-        try:
-            variant_num = random.choices(number_list_of_i, k=1)
-        except IndexError:
-            log.error(
-                f"\n{traceback.format_exc()}"
-                f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
-                f"An issue was found within the Attribute collection '{a}'. For more information on "
-                f"Blend_My_NFTs compatible scenes, see:\n{TextColors.RESET}"
-                f"https://github.com/torrinworx/Blend_My_NFTs#blender-file-organization-and-structure\n"
-            )
-            raise IndexError()
-    return str(variant_num[0])
+    def __init__(self):
+        self.counters = collections.defaultdict(collections.Counter)
+
+        # (rule name, rule type) -> Counter of the (attribute index, position) pairs selected by repairs:
+        self.selected = collections.defaultdict(collections.Counter)
+
+    def add(self, rule, seconds, evaluations=0, violations=0, rewrites=0):
+        counter = self.counters[(rule.name, rule.rule_type)]
+        counter["evaluations"] += evaluations
+        counter["violations"] += violations
+        counter["rewrites"] += rewrites
+        counter["seconds"] += seconds
+
+    def update(self, other):
+        for key, counter in other.counters.items():
+            self.counters[key].update(counter)
+        for key, selected in other.selected.items():
+            self.selected[key].update(selected)
+
+    def as_dict(self, hierarchy):
+        """Returns the profile formatted for LogicStats.json, Variants named as in hierarchy."""
+        attributes = list(hierarchy.keys())
+        variants = [list(hierarchy[a].keys()) for a in attributes]
+
+        stats = {}
+        for (name, rule_type), counter in self.counters.items():
+            selected = collections.Counter()
+            for (i, position), count in self.selected[(name, rule_type)].items():
+                selected[variants[i][position - 1] if position else f"{attributes[i]} Empty"] += count
+
+            stats.setdefault(name, {})[rule_type] = {
+                "evaluations": int(counter["evaluations"]),
+                "violations": int(counter["violations"]),
+                "rewrites": int(counter["rewrites"]),
+                "seconds": round(counter["seconds"], 6),
+                "selected_variants": dict(selected.most_common()),
+            }
+        return stats
+
+
+class RuleProgram:
+    """
+    The rules of a logic file compiled once per generation run by compile_logic(). Rules keep the order of the logic
+    file, the THEN part of a rule coming before its NOT part.
+    """
+
+    # Number of rule repairs after which a DNA is rejected, bounding the time spent repairing a single DNA:
+    max_repairs = 100
+
+    def __init__(self, rules, num_variants, unknown_items):
+        self.rules = rules
+        self.num_variants = num_variants
+        self.num_attributes = len(num_variants)
+
+        # (rule name, item) pairs of IF/THEN/NOT items that are neither an Attribute nor a Variant of the hierarchy:
+        self.unknown_items = unknown_items
+
+    def first_violated_rule(self, values, rule_stats=None):
+        """
+        Returns the first CompiledRule broken by values, a DNA row as a list of positions, None if there is none. Each
+        evaluation is profiled in rule_stats, a RuleStats, if given.
+        """
+        for rule in self.rules:
+            if rule_stats is None:
+                if rule.is_violated(values):
+                    return rule
+                continue
 
+            start = time.perf_counter()
+            violated = rule.is_violated(values)
+            rule_stats.add(rule, time.perf_counter() - start, evaluations=1, violations=int(violated))
+            if violated:
+                return rule
+        return None
+
+    def get_components(self):
+        """Returns the lists of Attribute indices connected to each other by rules, see get_rule_components()."""
+        return get_rule_components(self)
+
+    def violation_masks(self, matrix, rule_stats=None):
+        """
+        Evaluates every rule against matrix, an N x Attributes array of DNA rows, in one NumPy pass per rule. Returns a
+        list of boolean arrays of length N, aligned with self.rules, True where a DNA breaks the rule. Each pass is
+        profiled in rule_stats, a RuleStats, if given.
+        """
+        masks = []
+        for rule in self.rules:
+            start = time.perf_counter()
+            masks.append(rule.violated_rows(matrix, self.num_variants))
+            if rule_stats is not None:
+                rule_stats.add(
+                        rule, time.perf_counter() - start, evaluations=len(matrix), violations=int(masks[-1].sum())
+                )
+        return masks
+
+    def violated_rows(self, matrix, rule_stats=None):
+        """Returns a boolean array of length N, True for the rows of matrix that break at least one rule."""
+        violated = np.zeros(len(matrix), dtype=bool)
+        for mask in self.violation_masks(matrix, rule_stats):
+            violated |= mask
+        return violated
+
+    def apply(self, row, rng, rule_counter=None, conflict_counter=None, rule_stats=None):
+        """
+        Repairs the rules broken by a DNA row in place, the first broken rule at a time, until no rule is violated.
+        Returns True if the row was left valid.
+
+        Conflicting rules can undo each other's repairs forever. If a repair brings the DNA back to a state it already
+        went through, or after max_repairs repairs, the DNA is rejected: the row is left unchanged and False is
+        returned, so that the caller can draw another DNA.
+
+        If a collections.Counter is passed as rule_counter, it counts how many times each rule rewrote the DNA. If one
+        is passed as conflict_counter, it counts the DNA rejected because of each pair of conflicting rule names. If a
+        RuleStats is passed as rule_stats, every evaluation and repair is profiled in it.
+        """
+        values = [int(i) for i in row[:self.num_attributes]]
+        visited = {tuple(values): 0}
+        repaired = []
+        debug = log.isEnabledFor(logging.DEBUG)
+
+        rule = self.first_violated_rule(values, rule_stats)
+        while rule is not None:
+            if rule_stats is None:
+                rule.repair(values, rng)
+            else:
+                before = list(values)
+                start = time.perf_counter()
+                rule.repair(values, rng)
+                rule_stats.add(rule, time.perf_counter() - start, rewrites=1)
+                rule_stats.selected[(rule.name, rule.rule_type)].update(
+                        (i, values[i]) for i in range(self.num_attributes) if values[i] != before[i]
+                )
 
-def apply_rule_to_dna(hierarchy, deconstructed_dna, if_dict, result_dict, result_dict_type, enable_rarity):
-    """
-    Applies a single given rule to the DNA. This function does not apply multiple rules at the same time.
+            repaired.append(rule.name)
+            if rule_counter is not None:
+                rule_counter[rule.name] += 1
+            if debug:
+                log.debug(f"======={values} REPAIRED RULE {rule.name}======")
 
-    Then returns the new deconstructed_dna with the single rule applied to it.
-    """
+            state = tuple(values)
+            if state in visited or len(repaired) >= self.max_repairs:
+                # The rules repaired since the DNA was last in this state undo each other:
+                cycle = collections.Counter(repaired[visited.get(state, 0):])
+                conflict = tuple(sorted(name for name, count in cycle.most_common(2)))
+                if conflict_counter is not None:
+                    conflict_counter[conflict] += 1
+                if debug:
+                    log.debug(f"======={values} REJECTED, RULES {' AND '.join(conflict)} CONFLICT======")
+                return False
+            visited[state] = len(repaired)
 
-    # Check if Variants in if_dict are in deconstructed_dna, if so return if_list_selected = True:
-    if_list_selected = False  # True if item in the if_dict (items in the IF dictionary of a rule) are selected
-    for attribute_index, a in enumerate(deconstructed_dna):
-        attribute = list(hierarchy.keys())[attribute_index]
+            rule = self.first_violated_rule(values, rule_stats)
 
-        for b in hierarchy[attribute]:
-            if hierarchy[attribute][b]["number"] == a and attribute in if_dict:
-                a_dna_var = b
+        row[:self.num_attributes] = values
+        return True
 
-                if a_dna_var in list(if_dict[attribute].keys()):
-                    if_list_selected = True
-                    break
 
+def compile_logic(hierarchy, logic_file, enable_rarity, report_unknown_items=True):
+    """
+    Compiles logic_file, the rules of Logic.json or of the Logic UIList, into a RuleProgram for hierarchy. Items of a
+    rule are Attribute names, standing for all their Variants, or Variant names. Unknown items are logged as warnings
+    if report_unknown_items.
+    """
+    attributes = list(hierarchy.keys())
+    attribute_index = {attribute: i for i, attribute in enumerate(attributes)}
+    variant_position = {}
+    for i, attribute in enumerate(attributes):
+        for position, variant in enumerate(hierarchy[attribute], start=1):
+            variant_position[variant] = (i, position)
+
+    full_masks = [sum(1 << p for p in range(1, len(hierarchy[a]) + 1)) for a in attributes]
+    unknown_items = []
+
+    def get_masks(rule_name, items):
+        """Returns the {attribute index: bitmask} of the Variants a list of rule items stand for."""
+        masks = {}
+        for item in items:
+            if item in attribute_index:
+                i = attribute_index[item]
+                masks[i] = full_masks[i]
+            elif item in variant_position:
+                i, position = variant_position[item]
+                masks[i] = masks.get(i, 0) | (1 << position)
+            else:
+                unknown_items.append((rule_name, item))
+        return masks
+
+    def get_repair_choices(i, mask):
+        """Returns the positions of an Attribute set in mask and the AliasTable of their rarity."""
+        variants = list(hierarchy[attributes[i]].values())
+        positions = [p for p in range(1, len(variants) + 1) if (mask >> p) & 1]
+        weights = [float(variants[p - 1]["rarity"]) for p in positions] if enable_rarity else None
+        return positions, sampler.WeightedChoices(positions, weights).table
+
+    rules = []
+    for rule_name in logic_file:
+        if_masks = get_masks(rule_name, logic_file[rule_name]["IF"])
+
+        for rule_type in RULE_TYPES:
+            if rule_type not in logic_file[rule_name]:
                 continue
 
-    # If Variants in if_dict are selected, select random or rarity variants or set the to Empty depending on the rule.
-    if result_dict_type == "NOT":
-            for a in result_dict:  # For each Attribute in the NOT rule dictionary
-                attribute_index = list(hierarchy.keys()).index(a)
-                attribute = list(hierarchy.keys())[attribute_index]
-                full_att = list(result_dict[attribute].keys()) == list(
-                    hierarchy[attribute].keys())  # True if full attribute in rules
+            result_masks = get_masks(rule_name, logic_file[rule_name][rule_type])
+            full_attributes = {i for i, mask in result_masks.items() if mask == full_masks[i]}
 
-                if if_list_selected:
-                    # If 'a' is a full Attribute and Variants in if_dict selected, set 'a' to empty (0):
-                    if full_att:
-                        deconstructed_dna[attribute_index] = "0"
+            repair_choices = {}
+            for i, mask in result_masks.items():
+                if rule_type == "THEN":
+                    repair_choices[i] = get_repair_choices(i, mask)
+                elif i not in full_attributes:
+                    repair_choices[i] = get_repair_choices(i, full_masks[i] & ~mask)
 
-                    # Not a full Attribute, invert the variants selected so that we get a list
-                    # of just variants that can be selected. Because the NOT variants are what we don't want selected:
-                    if not full_att:
-                        var_selected_list = list(result_dict[a].keys())  # list of variants from 'NOT'
-                        att_selected_list = list(hierarchy[a].keys())  # full list of variants from hierarchy attribute
+            rules.append(CompiledRule(
+                rule_name,
+                rule_type,
+                list(if_masks.items()),
+                list(result_masks.items()),
+                full_attributes,
+                repair_choices
+            ))
 
-                        # Invert Variants set in NOT rule:
-                        var_selected_list = [i for i in att_selected_list if i not in var_selected_list]
+    for rule_name, item in unknown_items if report_unknown_items else ():
+        suggestions = difflib.get_close_matches(item, list(attribute_index) + list(variant_position), n=1)
+        log.warning(
+                f"\n'{item}' in {rule_name} is neither an Attribute nor a Variant of your scene, it will be ignored."
+                + (f" Did you mean '{suggestions[0]}'?" if suggestions else "")
+        )
 
-                        var_selected_list_complete = {}
-                        for i in var_selected_list:
-                            var_selected_list_complete[i] = get_var_info(i, hierarchy)
-                        result_dict[a] = var_selected_list_complete
+    return RuleProgram(rules, [len(hierarchy[a]) for a in attributes], unknown_items)
 
-                        # Select random or rarity from new result_dict with inverted variants if attribute is not full
-                        variant_list = list(result_dict[a].keys())
-                        deconstructed_dna[int(attribute_index)] = logic_rarity(variant_list, enable_rarity, a)
 
-    else:  # if result_dict_type == "THEN" basically
-        for a in result_dict:
-            attribute_index = list(hierarchy.keys()).index(a)
-            attribute = list(hierarchy.keys())[attribute_index]
-            full_att = list(result_dict[attribute].keys()) == list(
-                hierarchy[attribute].keys())  # True if full attribute in rules
+# Number of compiled logic files kept by get_logic_program():
+PROGRAM_CACHE_SIZE = 4
 
-            variant_list = list(result_dict[a].keys())
+# RulePrograms compiled by get_logic_program(), keyed by the content of the rules and of the hierarchy, most recently
+# used last:
+_program_cache = collections.OrderedDict()
 
-            # If 'a' is a full Attribute and Variants in if_dict are not selected, set 'a' to empty (0):
-            # This makes it so Attributes specified in THEN rules will only appear when a given Variant in if_dict is selected.
-            # if full_att and not if_list_selected:
-            #     deconstructed_dna[attribute_index] = "0"
 
-            # If Variants in if_dict selected, regardless if they make a full variant, select items from result_dict
-            if if_list_selected:
-                deconstructed_dna[int(attribute_index)] = logic_rarity(variant_list, enable_rarity, a)
+def get_logic_program(hierarchy, logic_file, enable_rarity):
+    """
+    Returns compile_logic(hierarchy, logic_file, enable_rarity), compiled once per session as long as neither the
+    rules nor the hierarchy change, so that repeated Create Data, Extend Data and audit runs skip compiling. The key
+    is the serialized content of both, a hierarchy being fully described by its Attribute and Variant names and data.
+    Compiled programs are never modified, so a cached program can be shared by any number of runs.
+    """
+    key = (json.dumps(logic_file, sort_keys=True), json.dumps(hierarchy, sort_keys=True), bool(enable_rarity))
+
+    program = _program_cache.get(key)
+    if program is None:
+        program = compile_logic(hierarchy, logic_file, enable_rarity)
+        _program_cache[key] = program
+        while len(_program_cache) > PROGRAM_CACHE_SIZE:
+            _program_cache.popitem(last=False)
+    else:
+        _program_cache.move_to_end(key)
+        log.info(f"\n - Logic rules unchanged since the last run, using the compiled rules.")
+
+    return program
 
-    return deconstructed_dna
 
+# Number of partial DNA count_valid_combinations() may visit before falling back to an upper bound, when creating data
+# and when refreshing the UI, where counting runs on Blender's main thread after every Logic edit:
+COUNT_MAX_NODES = 500000
+UI_COUNT_MAX_NODES = 50000
+UI_COUNT_MAX_SECONDS = 0.25
 
-def get_rule_break_type(hierarchy, deconstructed_dna, if_dict, result_dict, result_dict_type):
+
+class _CountBudgetExceeded(Exception):
+    pass
+
+
+class CountBudget:
     """
-    Checks if a given rule has been broken by deconstructed_dna.
+    Number of partial DNA that counting may still visit, and the time it may still take if max_seconds is given. A
+    single budget can be passed to several counts so that it covers all of them.
     """
-    # Check if Variants in 'if_dict' found in deconstructed_dna:
-    if_bool = False  # True if Variant in 'deconstructed_dna' found in 'if_dict'
-    for a in if_dict:  # Attribute in 'if_dict'
-        for b in if_dict[a]:  # Variant in if_dict[Attribute]
-            var_order_num = str(if_dict[a][b][1])  # Order number of 'b' (Variant)
-            dna_order_num = str(
-                deconstructed_dna[if_dict[a][b][4]])  # Order Number of 'b's attribute in deconstructed_dna
-
-            if var_order_num == dna_order_num:  # If DNA selected Variants found inside IF list variants:
-                if_bool = True
-                break
-        else:
-            continue
-        break
-
-    # Check if Variants in 'result_dict' found in deconstructed_dna:
-    full_att_bool = False
-    result_bool = False  # True if Variant in 'deconstructed_dna' found in 'result_dict'
-    then_bool = False
-    for a in result_dict:  # Attribute in 'result_dict'
-        for b in result_dict[a]:  # Variant in if_dict[Attribute]
-            var_order_num = str(result_dict[a][b][1])  # Order number of 'b' (Variant)
-            dna_order_num = str(
-                deconstructed_dna[result_dict[a][b][4]])  # Order Number of 'b's attribute in deconstructed_dna
-            if var_order_num == dna_order_num:  # If DNA selected Variants found inside THEN list variants:
-                if list(result_dict[a].keys()) == list(hierarchy[a].keys()):
-                    full_att_bool = True
-                result_bool = True
-                # break
-            else:
-                then_bool = True
-        else:
-            continue
-        break
 
-    # Rule Bool return summary:
-    violates_rule = False
+    def __init__(self, max_nodes, max_seconds=None):
+        self.nodes_left = max_nodes
+        self.deadline = time.monotonic() + max_seconds if max_seconds is not None else None
+
+    @property
+    def exhausted(self):
+        return self.nodes_left <= 0 or (self.deadline is not None and time.monotonic() > self.deadline)
 
-    # If Variants in 'if_dict' found in deconstructed_dna and Variants in 'result_dict' not found in deconstructed_dna:
-    if if_bool and then_bool:
-        violates_rule = True
 
-    elif if_bool and result_bool and result_dict_type == "NOT":
-        violates_rule = True
+def get_rule_components(program):
+    """Returns the lists of Attribute indices connected to each other by rules, Attributes in no rule left out."""
+    parents = list(range(program.num_attributes))
 
-    # If Variants in 'if_dict' not found in deconstructed_dna, and 'result_dict' variants are found in
-    # deconstructed_dna, and they are a part of a full Attribute in 'then_dict'
-    elif not if_bool and result_bool and full_att_bool:
-        violates_rule = True
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
 
-    # If Variants in 'if_dict' not found in deconstructed_dna, but Variants in 'then_dict' are found in
-    # deconstructed_dna, and don't make up a full Attribute:
-    # elif not if_bool and result_bool and not full_att_bool:
-    #     violates_rule = False
+    in_rules = set()
+    for rule in program.rules:
+        attributes = [i for i, _ in rule.if_masks + rule.result_masks]
+        in_rules.update(attributes)
+        for i in attributes[1:]:
+            parents[find(i)] = find(attributes[0])
 
-    return violates_rule, if_bool, result_bool, full_att_bool
+    components = collections.defaultdict(list)
+    for i in sorted(in_rules):
+        components[find(i)].append(i)
+    return list(components.values())
 
 
-def create_dicts(hierarchy, rule_list_items, result_dict_type):
+class _ComponentSearch:
     """
-    Example of output structure:
-
-    structure = {
-        "attribute1": {
-            "variant1": [
-                "name",
-                "order_number",
-                "rarity_number"
-                "attribute"
-                "attribute_index"
-            ],
-            "variant2": [
-                "name",
-                "order_number",
-                "rarity_number"
-                "attribute"
-                "attribute_index"
-            ]
-        },
-        "attribute2": {
-            "variant1": [
-                "name",
-                "order_number",
-                "rarity_number"
-                "attribute"
-                "attribute_index"
-            ],
-            "variant2": [
-                "name",
-                "order_number",
-                "rarity_number"
-                "attribute"
-                "attribute_index"
-            ]
-        }
-    }
+    Depth first search over the Attributes of a group of Attributes connected by rules, see count_valid_combinations().
+
+    Attributes are searched one after the other over their Variants, and Empty where a NOT rule holding the full
+    Attribute allows it. Variants that belong to exactly the same rule lists are searched once and weighted by the
+    number of DNA they stand for. A partial DNA is dropped as soon as a check whose Attributes are all assigned fails,
+    or as soon as it leaves a later Attribute no Variant passing the checks it can already run (forward checking).
+    Partial DNA that only differ in Attributes no later check reads share their count (dynamic programming).
+
+    Once budget is exhausted, count() returns an upper bound for the partial DNA it has not searched yet if
+    bound_on_exhaustion is True, and raises _CountBudgetExceeded otherwise.
     """
 
-    items_returned = collections.defaultdict(dict)
-    for a in rule_list_items:
-        for b in hierarchy:
-            if a == b:  # If 'a' is an Attribute, add all 'a' Variants to items_returned dict.
-                variant_list_of_a = list(hierarchy[a].keys())
-                variant_dict_of_a = {}
-                for c in variant_list_of_a:
-                    variant_dict_of_a[c] = get_var_info(c, hierarchy)
+    def __init__(self, program, component, weights, budget, bound_on_exhaustion=True):
+        self.budget = budget
+        self.bound_on_exhaustion = bound_on_exhaustion
+        self.exact = True
+
+        # Attributes that a NOT rule holding the full Attribute can set to Empty, and the rules that can:
+        emptying_rules = collections.defaultdict(list)
+        for rule in program.rules:
+            if rule.rule_type == "NOT":
+                for i in rule.full_attributes:
+                    emptying_rules[i].append(rule)
+
+        # Variants of an Attribute that are in the same rule lists are interchangeable, classes map each Attribute to
+        # (Variant position, positions of the interchangeable Variants) pairs, domains to (Variant position, number of
+        # DNA they stand for) pairs:
+        rule_masks = collections.defaultdict(list)
+        for rule in program.rules:
+            for i, mask in rule.if_masks + rule.result_masks:
+                rule_masks[i].append(mask)
+
+        self.classes = {}
+        self.domains = {}
+        for i in component:
+            classes = collections.OrderedDict()
+            for value in ([0] if i in emptying_rules else []) + list(range(1, program.num_variants[i] + 1)):
+                signature = (value == 0,) + tuple((mask >> value) & 1 for mask in rule_masks[i])
+                classes.setdefault(signature, (value, []))[1].append(value)
+            self.classes[i] = list(classes.values())
+            self.domains[i] = [(value, sum(weights[i][p] for p in positions)) for value, positions in self.classes[i]]
+
+        # Each check is (Attributes it reads, rule or None, Attribute set to Empty or None, rules that can empty it):
+        self.rules = [rule for rule in program.rules if rule.if_masks and rule.if_masks[0][0] in self.domains]
+        checks = [({i for i, _ in rule.if_masks + rule.result_masks}, rule, None, None) for rule in self.rules]
+        for i, rules in emptying_rules.items():
+            if i in self.domains:
+                checks.append(({i}.union(j for rule in rules for j, _ in rule.if_masks), None, i, rules))
+
+        # Attributes are searched so that each one shares as many checks as possible with the ones before it:
+        order = []
+        while len(order) < len(component):
+            order.append(max(
+                (i for i in component if i not in order),
+                key=lambda i: (sum(1 for check in checks if i in check[0] and check[0] & set(order)),
+                               sum(1 for check in checks if i in check[0]))
+            ))
+        self.order = order
+
+        # Each check runs once its last Attribute is assigned, and is stored with the level of the Attribute assigned
+        # before that one, -1 if it only reads one Attribute:
+        level_of = {i: level for level, i in enumerate(order)}
+        self.checks_at = [[] for i in order]
+        for check in checks:
+            levels = sorted(level_of[i] for i in check[0])
+            self.checks_at[levels[-1]].append((check, levels[-2] if len(levels) > 1 else -1))
+
+        # Later Attributes with a check that can first run once the Attribute of a level is assigned, with the checks
+        # reading only them and Attributes assigned by then (forward checking):
+        self.forward_checks = [[] for i in order]
+        for level in range(len(order)):
+            for later in range(level + 1, len(order)):
+                if any(prior == level for _, prior in self.checks_at[later]):
+                    self.forward_checks[level].append(
+                            (order[later], [check for check, prior in self.checks_at[later] if prior <= level])
+                    )
 
-                items_returned[a] = variant_dict_of_a
+        # Assigned Attributes still read by a check of a later level, the only ones a partial count depends on:
+        self.frontiers = []
+        for level in range(len(order)):
+            read_later = {i for checks in self.checks_at[level:] for check, _ in checks for i in check[0]}
+            self.frontiers.append([i for i in order[:level] if i in read_later])
+
+        self.values = [0] * program.num_attributes
+        self.count_memo = [{} for i in order]
+        self.analyze_memo = [{} for i in order]
+
+    def passes(self, check, ignored=None):
+        """True if the DNA values pass check. The checks of the rule ignored pass, and it can't empty an Attribute."""
+        attributes, rule, i, emptying_rules = check
+        if rule is not None:
+            return rule is ignored or not rule.is_violated(self.values)
+        return self.values[i] != 0 or any(r is not ignored and r.if_selected(self.values) for r in emptying_rules)
+
+    def count(self, level=0, ignored=None):
+        """
+        Returns the number of valid DNA completing the Attributes assigned before level, breaking no rule but ignored.
+        """
+        if level == len(self.order):
+            return 1
+
+        key = (ignored, tuple(self.values[i] for i in self.frontiers[level]))
+        memo = self.count_memo[level]
+        if key in memo:
+            return memo[key]
+
+        if self.budget.exhausted:
+            if not self.bound_on_exhaustion:
+                raise _CountBudgetExceeded()
+            self.exact = False
+            memo[key] = self.bound(level, ignored)
+            return memo[key]
+
+        count = 0
+        i = self.order[level]
+        for value, multiplicity in self.domains[i]:
+            self.budget.nodes_left -= 1
+            self.values[i] = value
+            if not all(self.passes(check, ignored) for check, _ in self.checks_at[level]):
+                continue
+            if not self.wiped_out(level, ignored):
+                count += multiplicity * self.count(level + 1, ignored)
+
+        memo[key] = count
+        return count
+
+    def wiped_out(self, level, ignored=None):
+        """
+        True if the Attributes assigned up to level leave a later Attribute no Variant that passes the checks reading
+        only it and assigned Attributes, in which case the partial DNA has no valid completion.
+        """
+        for i, checks in self.forward_checks[level]:
+            self.budget.nodes_left -= len(self.domains[i])
+            if not any(self.passes_all(i, value, checks, ignored) for value, _ in self.domains[i]):
+                return True
+        return False
+
+    def passes_all(self, i, value, checks, ignored=None):
+        """True if the DNA values pass every check of checks with Attribute i set to value."""
+        self.values[i] = value
+        return all(self.passes(check, ignored) for check in checks)
+
+    def bound(self, level, ignored=None):
+        """
+        Returns an upper bound of count(level, ignored) without searching: the product, for each unassigned Attribute,
+        of the DNA its Variants stand for that pass the checks reading only it and the Attributes assigned so far.
+        """
+        bound = 1
+        for next_level in range(level, len(self.order)):
+            i = self.order[next_level]
+            allowed = 0
+            for value, multiplicity in self.domains[i]:
+                self.values[i] = value
+                if all(self.passes(check, ignored) for check, prior in self.checks_at[next_level] if prior < level):
+                    allowed += multiplicity
+            bound *= allowed
+        return bound
+
+    def analyze(self, level=0):
+        """
+        Searches the valid DNA completing the Attributes assigned before level once, for analyze_logic(). Returns:
+          - The number of valid DNA.
+          - For each rule, the number of valid DNA in which it is the only rule letting an Attribute be Empty, DNA no
+            longer valid without it.
+          - For each rule, the number of DNA breaking only that rule and valid without it. With the two counts above,
+            the number of valid DNA without a rule is known without searching again.
+          - The rules applied by at least one valid DNA.
+          - The (Attribute, Variant position) pairs selected by at least one valid DNA, a Variant position standing for
+            its class of interchangeable Variants.
+        Raises _CountBudgetExceeded once budget is exhausted.
+        """
+        if level == len(self.order):
+            return 1, {}, {}, set(), set()
+
+        key = tuple(self.values[i] for i in self.frontiers[level])
+        memo = self.analyze_memo[level]
+        if key in memo:
+            return memo[key]
+
+        if self.budget.exhausted:
+            raise _CountBudgetExceeded()
+
+        num_valid = 0
+        sole_counts = collections.Counter()
+        only_counts = collections.Counter()
+        applied = set()
+        selected = set()
+
+        i = self.order[level]
+        for value, multiplicity in self.domains[i]:
+            self.budget.nodes_left -= 1
+            self.values[i] = value
+
+            # Rules broken, applied, and alone in letting an Attribute be Empty, at this level:
+            broken = []
+            applied_here = set()
+            sole = set()
+            for (attributes, rule, k, emptying_rules), _ in self.checks_at[level]:
+                if rule is not None:
+                    if rule.if_selected(self.values):
+                        applied_here.add(rule)
+                    if rule.is_violated(self.values):
+                        broken.append(rule)
+                elif self.values[k] == 0:
+                    justifying = [r for r in emptying_rules if r.if_selected(self.values)]
+                    if len(justifying) == 1:
+                        sole.add(justifying[0])
+                    elif not justifying:
+                        broken.append(None)
+
+            if len(broken) > 1 or None in broken:
+                continue
 
-            if a in list(hierarchy[b].keys()):  # If 'a' is a Variant, add all info about that variant to items_returned
-                items_returned[b][a] = get_var_info(a, hierarchy)
+            if broken:
+                if broken[0] not in sole:
+                    only_counts[broken[0]] += multiplicity * self.count(level + 1, broken[0])
+                continue
 
-    items_returned = dict(items_returned)
+            # No forward checking here, partial DNA without valid completions still count the DNA breaking one rule:
+            child_valid, child_sole, child_only, child_applied, child_selected = self.analyze(level + 1)
+            num_valid += multiplicity * child_valid
+            for rule, count in child_sole.items():
+                if rule not in sole:
+                    sole_counts[rule] += multiplicity * count
+            for rule in sole:
+                sole_counts[rule] += multiplicity * child_valid
+            for rule, count in child_only.items():
+                if rule not in sole:
+                    only_counts[rule] += multiplicity * count
+            if child_valid:
+                applied |= applied_here | child_applied
+                selected |= {(i, value)} | child_selected
+
+        memo[key] = num_valid, sole_counts, only_counts, applied, selected
+        return memo[key]
+
+
+def count_valid_combinations(program, max_nodes=COUNT_MAX_NODES, material_counts=None, budget=None):
+    """
+    Returns the number of DNA that break no rule of program, and whether that number is exact. material_counts is the
+    number of Material slots of each Variant returned by dna_codec.get_material_counts() if Materials are enabled, each
+    Variant is then counted once per Material slot.
+
+    Attributes in no rule multiply the count by their number of Variants. Attributes connected by rules are counted
+    together by a _ComponentSearch. The search visits at most max_nodes partial DNA over all groups of Attributes, or
+    spends budget, a CountBudget, if given. Partial DNA left once it is spent are bounded by the Variants of each
+    remaining Attribute that the rules still allow given the Attributes already assigned, making the total an upper
+    bound.
+    """
+    if budget is None:
+        budget = CountBudget(max_nodes)
 
-    return dict(items_returned)
+    total = 1
+    exact = True
 
+    # Number of distinct DNA each Variant position stands for, Empty is a single DNA:
+    if material_counts is None:
+        material_counts = [[1] * num_variants for num_variants in program.num_variants]
+    weights = [[1] + list(counts) for counts in material_counts]
 
-def logicafy_dna_single(hierarchy, single_dna, logic_file, enable_rarity):
-    deconstructed_dna = single_dna.split("-")
-    did_reconstruct = True
-    original_dna = str(single_dna)
+    components = get_rule_components(program)
+    in_rules = {i for component in components for i in component}
+    for i in range(program.num_attributes):
+        if i not in in_rules:
+            total *= sum(weights[i][1:])
 
-    while did_reconstruct:
-        did_reconstruct = False
-        for rule in logic_file:
-            # Items from 'IF' key for a given rule
-            if_dict = create_dicts(hierarchy, logic_file[rule]["IF"], "IF")
+    for component in components:
+        search = _ComponentSearch(program, component, weights, budget)
+        total *= search.count()
+        exact &= search.exact
 
-            # TODO: This needs to be made more efficient with less repeating code, but it works I guess:
-            if "THEN" in logic_file[rule]:
-                result_dict_type = "THEN"
-                result_dict = create_dicts(hierarchy, logic_file[rule][result_dict_type], result_dict_type)
+    return total, exact
 
-                # Change 'then_bool' to 'result_bool'
-                violates_rule, if_bool, then_bool, full_att_bool = get_rule_break_type(
-                    hierarchy,
-                    deconstructed_dna,
-                    if_dict,
-                    result_dict,
-                    result_dict_type,
-                )
 
-                # Check THEN rule again but swap IF and THEN dicts.
-                if not violates_rule:
-                    violates_rule, if_bool, then_bool, full_att_bool = get_rule_break_type(
-                        hierarchy,
-                        deconstructed_dna,
-                        result_dict,
-                        if_dict,
-                        result_dict_type,
-                    )
+# Number of partial DNA analyze_logic() may visit and seconds it may take over all its checks, rules left are reported
+# as not analyzed:
+ANALYSIS_MAX_NODES = 300000
+ANALYSIS_MAX_SECONDS = 3
 
-                if violates_rule:
-                    log.debug(f"======={deconstructed_dna} VIOLATES RULE======")
 
-                    deconstructed_dna = apply_rule_to_dna(
-                        hierarchy,
-                        deconstructed_dna,
-                        if_dict,
-                        result_dict,
-                        result_dict_type,
-                        enable_rarity
-                    )
+def analyze_logic(hierarchy, program, max_nodes=ANALYSIS_MAX_NODES, max_seconds=ANALYSIS_MAX_SECONDS):
+    """
+    Pre-flight analysis of a RuleProgram, run before generation so that problems with the rules are reported in seconds
+    instead of showing up in the generated DNA. Returns a list of warnings and a report of how much each rule reduces
+    the number of combinations. Warnings are given for:
+      - Rules that can never apply, because every DNA selecting their IF Variants breaks a rule.
+      - Rules that are redundant, other rules already excluding every DNA they exclude.
+      - Pairs of rules that contradict each other for the same IF Variants.
+      - Variants that no DNA can select, and Attributes that lose all their Variants.
+
+    The Attributes connected by rules are searched once per group with _ComponentSearch.analyze(), which gives every
+    count above at once. The searches share a budget of max_nodes partial DNA and max_seconds, groups of rules left when
+    it runs out are reported as not analyzed and only checked for contradicting pairs.
+    """
+    attributes = list(hierarchy.keys())
+    variants = [list(hierarchy[a].keys()) for a in attributes]
+    full_masks = [sum(1 << p for p in range(1, n + 1)) for n in program.num_variants]
+    weights = [[1] * (num_variants + 1) for num_variants in program.num_variants]
+
+    rule_names = collections.Counter(rule.name for rule in program.rules)
 
-                    new_dna = reconstruct_dna(deconstructed_dna)
-                    if new_dna != original_dna:
-                        original_dna = str(new_dna)
-                        did_reconstruct = True
-                        break
-            # TODO: This needs to be made more efficient with less repeating code, but it works I guess:
-            if "NOT" in logic_file[rule]:
-                result_dict_type = "NOT"
-                result_dict = create_dicts(hierarchy, logic_file[rule][result_dict_type], result_dict_type)
-
-                # Change 'then_bool' to 'result_bool'
-                violates_rule, if_bool, then_bool, full_att_bool = get_rule_break_type(
-                    hierarchy,
-                    deconstructed_dna,
-                    if_dict,
-                    result_dict,
-                    result_dict_type,
+    def label(rule):
+        return rule.name if rule_names[rule.name] == 1 else f"{rule.name} ({rule.rule_type})"
+
+    def mask_names(i, mask):
+        return [variants[i][p - 1] for p in range(1, program.num_variants[i] + 1) if (mask >> p) & 1]
+
+    warnings = []
+    report = []
+
+    for rule in program.rules:
+        if not rule.if_masks or not rule.result_masks:
+            warnings.append(f"{label(rule)} has no IF or {rule.rule_type} item of your scene and is ignored.")
+
+    budget = CountBudget(max_nodes, max_seconds)
+    for component in get_rule_components(program):
+        search = _ComponentSearch(program, component, weights, budget, bound_on_exhaustion=False)
+        rules = [rule for rule in search.rules if rule.result_masks]
+        try:
+            num_valid, sole_counts, only_counts, applied, selected = search.analyze()
+        except _CountBudgetExceeded:
+            report.append(
+                    f"\n - {', '.join(label(rule) for rule in rules)}: not analyzed, too intertwined to be checked "
+                    f"in time."
+            )
+            continue
+
+        if num_valid == 0:
+            warnings.append(
+                    f"No DNA can satisfy {', '.join(label(rule) for rule in rules)} together, no NFT can be generated."
+            )
+            continue
+
+        for rule in rules:
+            num_without = num_valid - sole_counts[rule] + only_counts[rule]
+            if rule not in applied:
+                warnings.append(
+                        f"{label(rule)} can never apply, every DNA selecting its IF Variants breaks a rule, so these "
+                        f"Variants are never selected."
                 )
+            elif num_valid == num_without:
+                warnings.append(f"{label(rule)} is redundant, other rules already exclude every DNA it excludes.")
 
-                # Check NOT rule again but swap IF and NOT dicts.
-                if not violates_rule:
-                    violates_rule, if_bool, then_bool, full_att_bool = get_rule_break_type(
-                        hierarchy,
-                        deconstructed_dna,
-                        result_dict,
-                        if_dict,
-                        result_dict_type,
-                    )
+            if num_without:
+                reduction = 100 * (num_without - num_valid) / num_without
+                report.append(f"\n - {label(rule)}: removes {reduction:.2f}% of the combinations.")
 
-                if violates_rule:
-                    log.debug(f"======={deconstructed_dna} VIOLATES RULE======")
+        # Variants no valid DNA selects, a class of interchangeable Variants is selected as a whole:
+        for i in component:
+            dead = sorted(
+                p for value, positions in search.classes[i] if value and (i, value) not in selected for p in positions
+            )
+            if len(dead) == program.num_variants[i]:
+                warnings.append(f"No DNA can select any Variant of '{attributes[i]}', the rules wipe it out.")
+            elif dead:
+                warnings.append(
+                        f"No DNA can select {', '.join(variants[i][p - 1] for p in dead)} of '{attributes[i]}'."
+                )
 
-                    deconstructed_dna = apply_rule_to_dna(
-                        hierarchy,
-                        deconstructed_dna,
-                        if_dict,
-                        result_dict,
-                        result_dict_type,
-                        enable_rarity
-                    )
+    # Rules sharing IF Variants whose THEN/NOT lists leave an Attribute nothing to select:
+    for j, rule in enumerate(program.rules):
+        for other in program.rules[j + 1:]:
+            shared = [(i, mask & other_mask) for i, mask in rule.if_masks for k, other_mask in other.if_masks
+                      if i == k and mask & other_mask]
+            if not shared:
+                continue
 
-                    new_dna = reconstruct_dna(deconstructed_dna)
-                    if new_dna != original_dna:
-                        original_dna = str(new_dna)
-                        did_reconstruct = True
-                        break
+            for i, mask in rule.result_masks:
+                for k, other_mask in other.result_masks:
+                    if i != k:
+                        continue
+                    allowed = mask if rule.rule_type == "THEN" else full_masks[i] & ~mask
+                    other_allowed = other_mask if other.rule_type == "THEN" else full_masks[i] & ~other_mask
+                    # Empty satisfies both NOT lists, and is selected when one of them holds the full Attribute:
+                    allow_empty = rule.rule_type == other.rule_type == "NOT" and (
+                            i in rule.full_attributes or i in other.full_attributes)
+                    if not allowed & other_allowed and not allow_empty:
+                        shared_names = [name for k, mask in shared for name in mask_names(k, mask)]
+                        warnings.append(
+                                f"{label(rule)} and {label(other)} contradict each other on '{attributes[i]}' when "
+                                f"{', '.join(shared_names)} is selected."
+                        )
+
+    return warnings, "".join(report)
 
-    return str(reconstruct_dna(deconstructed_dna))
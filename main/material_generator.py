@@ -4,130 +4,118 @@
 # Where the numbers right of the ":" are the material numbers applied to the respective Variants to the left of the ":"
 
 import json
-import random
 import logging
 import traceback
+
+import numpy as np
+
 from .helpers import TextColors
+from . import sampler
 
 log = logging.getLogger(__name__)
 
 
-def select_material(material_list, variant, enable_rarity):
-    """Selects a material from a passed material list. """
-    material_list_of_i = []  # List of Material names instead of order numbers
-    rarity_list_of_i = []
-    if_zero_bool = None
-
-    for material in material_list:
-        # Material Order Number comes from index in the Material List in materials.json for a given Variant.
-        # material_order_num = list(material_list.keys()).index(material)
-
-        material_list_of_i.append(material)
-
-        material_rarity_percent = material_list[material]
-        rarity_list_of_i.append(float(material_rarity_percent))
-
-    # print(f"MATERIAL_LIST_OF_I:{material_list_of_i}")
-    # print(f"RARITY_LIST_OF_I:{rarity_list_of_i}")
-
-    for b in rarity_list_of_i:
-        if b == 0:
-            if_zero_bool = True
-        elif b != 0:
-            if_zero_bool = False
-
-    if enable_rarity:
-        try:
-            if if_zero_bool:
-                selected_material = random.choices(material_list_of_i, k=1)
-            elif not if_zero_bool:
-                selected_material = random.choices(material_list_of_i, weights=rarity_list_of_i, k=1)
-        except IndexError:
-            log.error(
-                    f"\n{traceback.format_exc()}"
-                    f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
-                    f"An issue was found within the Material List of the Variant collection '{variant}'. For more "
-                    f"information on Blend_My_NFTs compatible scenes, see:\n{TextColors.RESET}"
-                    f"https://github.com/torrinworx/Blend_My_NFTs#blender-file-organization-and-structure\n"
-            )
-            raise IndexError()
-    else:
-        try:
-            selected_material = random.choices(material_list_of_i, k=1)
-        except IndexError:
-            log.error(
-                    f"\n{traceback.format_exc()}"
-                    f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
-                    f"An issue was found within the Material List of the Variant collection '{variant}'. For more "
-                    f"information on Blend_My_NFTs compatible scenes, see:\n{TextColors.RESET}"
-                    f"https://github.com/torrinworx/Blend_My_NFTs#blender-file-organization-and-structure\n"
-            )
-            raise IndexError()
-
-    return selected_material[0], material_list
-
-
-def get_variant_att_index(variant, hierarchy):
-    variant_attribute = None
-
-    for attribute in hierarchy:
-        for variant_h in hierarchy[attribute]:
-            if variant_h == variant:
-                variant_attribute = attribute
-
-    attribute_index = list(hierarchy.keys()).index(variant_attribute)
-    variant_order_num = variant.split("_")[1]
-    return attribute_index, variant_order_num
-
-
-def match_dna_to_variant(hierarchy, single_dna):
-    """
-    Matches each DNA number separated by "-" to its attribute, then its variant.
+class MaterialIndex:
     """
+    materials.json loaded and indexed once per generation run. For each Attribute, Variant numbers are mapped to
+    Variant names, and each Variant with a Material List to its Material names and the WeightedChoices of their
+    Material numbers, so that applying Materials to a DNA is a few dictionary lookups and one draw per Attribute.
 
-    list_attributes = list(hierarchy.keys())
-    list_dna_decunstructed = single_dna.split('-')
-    dna_dictionary = {}
-
-    for i, j in zip(list_attributes, list_dna_decunstructed):
-        dna_dictionary[i] = j
-
-    for x in dna_dictionary:
-        for k in hierarchy[x]:
-            k_num = hierarchy[x][k]["number"]
-            if k_num == dna_dictionary[x]:
-                dna_dictionary.update({x: k})
-    return dna_dictionary
-
+    Material numbers are 1 based positions in the Material List of a Variant, 0 meaning no Material was selected.
+    """
 
-def apply_materials(hierarchy, single_dna, materials_file, enable_rarity):
+    def __init__(self, hierarchy, materials, enable_rarity):
+        """
+        hierarchy: Hierarchy returned by helpers.get_hierarchy() or saved in NFTRecord.json.
+        materials: The loaded materials.json dictionary.
+        """
+        self.materials = materials
+        self.enable_rarity = enable_rarity
+        self.attributes = list(hierarchy.keys())
+        self.variant_names = [
+            {hierarchy[a][v]["number"]: v for v in hierarchy[a]} for a in self.attributes
+        ]
+        self.material_names = {
+            variant: list(materials[variant]["Material List"].keys()) for variant in materials
+        }
+
+        # For each Attribute, the 1 based DNA row positions of its Variants that have a Material List:
+        self.material_variants = [
+            [(position, v) for position, v in enumerate(hierarchy[a], start=1) if v in materials]
+            for a in self.attributes
+        ]
+
+        # Built on first use, so that a broken Material List only raises once its Variant is selected:
+        self._choices = {}
+
+    def get_choices(self, variant):
+        """Returns the WeightedChoices of the Material numbers of a Variant, None if it has no Material List."""
+        choices = self._choices.get(variant)
+        if choices is None and variant in self.materials:
+            material_list = self.materials[variant]["Material List"]
+            rarity_list = [float(material_list[material]) for material in material_list]
+
+            try:
+                choices = sampler.WeightedChoices(
+                        range(1, len(material_list) + 1), rarity_list if self.enable_rarity else None
+                )
+            except IndexError:
+                log.error(
+                        f"\n{traceback.format_exc()}"
+                        f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
+                        f"An issue was found within the Material List of the Variant collection '{variant}'. For more "
+                        f"information on Blend_My_NFTs compatible scenes, see:\n{TextColors.RESET}"
+                        f"https://github.com/torrinworx/Blend_My_NFTs#blender-file-organization-and-structure\n"
+                )
+                raise IndexError()
+
+            self._choices[variant] = choices
+        return choices
+
+    def material_numbers(self, deconstructed_dna, rng):
+        """Returns the deconstructed Material DNA of a deconstructed DNA, the Material numbers in Attribute order."""
+        material_dna = []
+        for variant_names, number in zip(self.variant_names, deconstructed_dna):
+            variant = variant_names.get(str(number))
+            choices = self.get_choices(variant) if variant is not None else None
+            material_dna.append(choices.draw(rng) if choices is not None else 0)
+        return material_dna
+
+    def apply_to_rows(self, matrix, rng):
+        """
+        Draws the Materials of every DNA row of matrix in place, see dna_codec.py for the row layout. Works column-wise:
+        for each Variant with a Material List, the Materials of all rows holding that Variant are drawn at once. Rows
+        whose Variant has no Material List are given Material number 0.
+        """
+        num_attributes = len(self.attributes)
+        matrix[:, num_attributes:] = 0
+        for column, material_variants in enumerate(self.material_variants):
+            for position, variant in material_variants:
+                rows = np.flatnonzero(matrix[:, column] == position)
+                if len(rows):
+                    matrix[rows, num_attributes + column] = self.get_choices(variant).draw_many(rng, len(rows))
+
+
+def apply_materials(hierarchy, deconstructed_dna, materials_file, enable_rarity, rng=None, material_index=None):
     """
     DNA with applied material example: "1-1:1-1" <Normal DNA>:<Selected Material for each Variant>
 
     The Material DNA will select the material for the Variant order number in the NFT DNA based on the Variant Material
-    list in the Variant_Material.json file.
-    """
-
-    single_dna_dict = match_dna_to_variant(hierarchy, single_dna)
-    materials_file = json.load(open(materials_file))
-    deconstructed_material_dna = {}
+    list in the Variant_Material.json file. Returns the deconstructed Material DNA, the list of Material numbers in
+    Attribute order. Materials are drawn from rng, the random stream of the generation run. material_index is the
+    MaterialIndex of materials_file, built once per generation run; it is built here from materials_file if None.
 
-    for a in single_dna_dict:
-        complete = False
-        for b in materials_file:
-            if single_dna_dict[a] == b:
-                material_name, material_list, = select_material(materials_file[b]['Material List'], b, enable_rarity)
+    Material numbers come from the index in the Material List in materials.json for a given Variant, plus 1 because 0
+    is what we return on an invalid lookup. If we didn't add 1 then when material index 0 is chosen randomly we would
+    not change materials, and conversely the last material in the list would never show up.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
 
-                # Gets the Order Number of the Material
-				# We add 1 to the index because 0 is what we return on an invalid lookup. 
-				# If we don't add 1 then when material index 0 is chosen randomly we will not change materials, 
-				# and conversly the last material in the list will never show up
-                material_order_num = (list(material_list.keys()).index(material_name))+1
+    if material_index is None:
+        material_index = MaterialIndex(hierarchy, json.load(open(materials_file)), enable_rarity)
 
-                deconstructed_material_dna[a] = str(material_order_num)
-                complete = True
-        if not complete:
-            deconstructed_material_dna[a] = "0"
+    deconstructed_material_dna = material_index.material_numbers(deconstructed_dna, rng)
 
     # This section is now incorrect and needs updating:
 
@@ -140,10 +128,4 @@ def apply_materials(hierarchy, single_dna, materials_file, enable_rarity):
     # for i in synced_material_attributes:
     #     deconstructed_material_dna[i] = first_mat
 
-    material_dna = ""
-    for a in deconstructed_material_dna:
-        num = "-" + str(deconstructed_material_dna[a])
-        material_dna += num
-    material_dna = ''.join(material_dna.split('-', 1))
-
-    return f"{single_dna}:{material_dna}"
+    return deconstructed_material_dna
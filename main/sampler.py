@@ -0,0 +1,584 @@
+# Purpose:
+# This file precomputes the weighted Variant tables of a hierarchy once, then draws whole batches of Variant selections
+# with NumPy. It is used by dna_generator.py instead of picking Variants one DNA and one Attribute at a time. The same
+# alias tables are used by logic.py and material_generator.py for the single Variant and Material choices they make.
+
+import logging
+
+import numpy as np
+
+from .helpers import TextColors
+from . import dna_codec
+
+log = logging.getLogger(__name__)
+
+
+def get_variant_weights(hierarchy, attribute, enable_rarity):
+    """
+    Returns the list of weights for each Variant of a given Attribute in hierarchy order. If Rarity is off, or if all
+    rarity percentages of the Attribute are 0, all Variants are weighted equally.
+    """
+
+    variants = hierarchy[attribute]
+
+    if not variants:
+        raise IndexError(
+            f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
+            f"An issue was found within the Attribute collection '{attribute}'. For more information on Blend_My_NFTs "
+            f"compatible scenes, see:\n{TextColors.RESET}"
+            f"https://github.com/torrinworx/Blend_My_NFTs#blender-file-organization-and-structure\n"
+        )
+
+    weights = [1.0] * len(variants)
+    if enable_rarity:
+        rarities = [float(variants[v]["rarity"]) for v in variants]
+        if sum(rarities) > 0:
+            weights = rarities
+
+    return weights
+
+
+class AliasTable:
+    """
+    Vose alias table of a list of weights. Once built, each draw of a position costs one uniform integer and one
+    uniform float, whatever the number of weights. If all weights are 0, positions are drawn uniformly.
+    """
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        self.num_items = len(weights)
+
+        if not self.num_items:
+            raise IndexError()
+
+        if not weights.sum() > 0:
+            weights = np.ones(self.num_items)
+
+        scaled = weights * self.num_items / weights.sum()
+        probabilities = np.ones(self.num_items)
+        aliases = np.arange(self.num_items)
+
+        small = [i for i in range(self.num_items) if scaled[i] < 1]
+        large = [i for i in range(self.num_items) if scaled[i] >= 1]
+        while small and large:
+            i = small.pop()
+            j = large.pop()
+            probabilities[i] = scaled[i]
+            aliases[i] = j
+            scaled[j] += scaled[i] - 1
+            (small if scaled[j] < 1 else large).append(j)
+
+        self.probabilities = probabilities
+        self.aliases = aliases
+
+        # Plain lists are faster than NumPy arrays for single draws:
+        self._probability_list = probabilities.tolist()
+        self._alias_list = aliases.tolist()
+
+    def draw_one(self, rng):
+        """Returns a single 0 based position."""
+        i = int(rng.integers(self.num_items))
+        return i if rng.random() < self._probability_list[i] else self._alias_list[i]
+
+    def draw(self, rng, size):
+        """Returns an array of size 0 based positions."""
+        columns = rng.integers(self.num_items, size=size)
+        accepted = rng.random(size) < self.probabilities[columns]
+        return np.where(accepted, columns, self.aliases[columns])
+
+
+class WeightedChoices:
+    """A list of values and the AliasTable of their weights, all values weighted equally if weights is None."""
+
+    def __init__(self, values, weights=None):
+        self.values = list(values)
+        self.table = AliasTable([1.0] * len(self.values) if weights is None else weights)
+
+    def draw(self, rng):
+        """Returns one of the values."""
+        return self.values[self.table.draw_one(rng)]
+
+    def draw_many(self, rng, size):
+        """Returns an array of size values."""
+        return np.asarray(self.values)[self.table.draw(rng, size)]
+
+
+class AttributeSampler:
+    """
+    Alias tables for every Attribute in a hierarchy. Variants are identified by their 1 based position in the
+    hierarchy, the same position used by DNA rows.
+
+    If materials is given, the combination space used by permutation() and rows_from_indices() is made of Material
+    slots instead of Variants: each Attribute takes one (Variant, Material) pair, as many pairs per Variant as it has
+    Materials (see dna_codec.get_material_counts()), so that the Material digits of DNA rows are enumerated as well.
+    """
+
+    def __init__(self, hierarchy, enable_rarity, materials=None):
+        self.attributes = list(hierarchy.keys())
+        self.enable_rarity = enable_rarity
+        self.probabilities = []
+        self.alias_tables = []
+
+        for attribute in self.attributes:
+            weights = np.array(get_variant_weights(hierarchy, attribute, enable_rarity), dtype=np.float64)
+            self.probabilities.append(weights / weights.sum())
+            self.alias_tables.append(AliasTable(weights))
+
+        self.shape = tuple(len(p) for p in self.probabilities)
+
+        # Material slots of each Attribute, their Variant position, Material number (0 without Materials) and
+        # probability, the Variant probability split between its Materials by their rarity:
+        self.materials = materials
+        self.slot_positions = []
+        self.slot_materials = []
+        self.slot_probabilities = []
+        material_counts = dna_codec.get_material_counts(hierarchy, materials)
+        for attribute, probabilities, counts in zip(self.attributes, self.probabilities, material_counts):
+            positions = []
+            numbers = []
+            slot_probabilities = []
+            for position, (variant, probability, count) in enumerate(
+                    zip(hierarchy[attribute], probabilities, counts), start=1
+            ):
+                material_weights = np.ones(count)
+                if materials is not None and variant in materials:
+                    material_list = materials[variant]["Material List"]
+                    rarities = np.array([float(material_list[m]) for m in material_list], dtype=np.float64)
+                    if enable_rarity and rarities.sum() > 0:
+                        material_weights = rarities
+
+                positions += [position] * count
+                numbers += list(range(1, count + 1)) if materials is not None and variant in materials else [0]
+                slot_probabilities += list(probability * material_weights / material_weights.sum())
+
+            self.slot_positions.append(np.array(positions, dtype=np.uint16))
+            self.slot_materials.append(np.array(numbers, dtype=np.uint16))
+            self.slot_probabilities.append(np.array(slot_probabilities, dtype=np.float64))
+
+        self.slot_shape = tuple(len(p) for p in self.slot_positions)
+
+    @property
+    def num_combinations(self):
+        """
+        The number of combinations of the hierarchy, ignoring Logic. Each Material of a Variant is a distinct
+        combination if materials was given.
+        """
+        combinations = 1
+        for num_slots in self.slot_shape:
+            combinations *= num_slots
+        return combinations
+
+    def draw(self, rng, size):
+        """Returns a (size x Attributes) matrix of Variant positions drawn column by column."""
+        matrix = np.empty((size, len(self.attributes)), dtype=np.uint16)
+
+        for column, alias_table in enumerate(self.alias_tables):
+            matrix[:, column] = alias_table.draw(rng, size) + 1
+
+        return matrix
+
+    def permutation(self, rng):
+        """
+        Returns the index of every combination in a random order, each combination appearing exactly once. With
+        Rarity on, the order is a weighted draw without replacement (each combination weighted by the product of its
+        Variant and Material weights), and combinations with a weight of 0 are left out.
+
+        Indices are read back as rows with rows_from_indices(). The whole combination space is held in memory, so this
+        is only meant for collections close to the number of combinations.
+        """
+        if not self.enable_rarity:
+            return rng.permutation(self.num_combinations)
+
+        with np.errstate(divide="ignore"):
+            log_weights = np.zeros(1)
+            for probabilities in self.slot_probabilities:
+                log_weights = (log_weights[:, None] + np.log(probabilities)[None, :]).ravel()
+
+        # Efraimidis-Spirakis keys, the smallest Exp(1)/weight comes first:
+        keys = np.log(rng.exponential(size=self.num_combinations)) - log_weights
+        order = np.argsort(keys, kind="stable")
+        return order[:np.count_nonzero(np.isfinite(keys))]
+
+    def rows_from_indices(self, indices):
+        """
+        Returns the matrix of the DNA rows of combination indices, one Variant position column per Attribute, followed
+        by one Material number column per Attribute if materials was given.
+        """
+        width = len(self.attributes) * (2 if self.materials is not None else 1)
+        if not self.slot_shape:
+            return np.zeros((len(indices), width), dtype=np.uint16)
+
+        digits = np.unravel_index(np.asarray(indices, dtype=np.int64), self.slot_shape)
+        columns = [positions[d] for positions, d in zip(self.slot_positions, digits)]
+        if self.materials is not None:
+            columns += [numbers[d] for numbers, d in zip(self.slot_materials, digits)]
+        return np.stack(columns, axis=1)
+
+
+class ConstraintSampler:
+    """
+    Draws DNA rows that satisfy every rule of a logic.RuleProgram by construction, instead of drawing rows at random and
+    repairing them. Attributes are assigned one at a time in dependency order, the Attributes of IF lists before the
+    Attributes their rules constrain. Each Attribute is drawn by rarity among the Variants the rules still allow given
+    the Attributes assigned so far, and a Variant is only kept if every unassigned Attribute is left with at least one
+    allowed Variant (forward checking). If no Variant fits, the previous Attribute is drawn again.
+
+    As with repaired DNA, an Attribute is only Empty when a NOT rule holding the full Attribute applies to the DNA.
+    When a dependency cycle puts an IF Attribute of that rule later in the order, Empty is drawn like one more
+    Variant, and the DNA is drawn again from there if the rule ends up not applying.
+    """
+
+    # Number of Attribute assignments tried for a single DNA before giving up:
+    max_assignments = 10000
+
+    def __init__(self, hierarchy, program, enable_rarity):
+        self.attributes = list(hierarchy.keys())
+        self.num_attributes = len(self.attributes)
+        self.weights = [get_variant_weights(hierarchy, a, enable_rarity) for a in self.attributes]
+        self.alias_tables = [AliasTable(w) for w in self.weights]
+        self.full_masks = [sum(1 << p for p in range(1, len(w) + 1)) for w in self.weights]
+
+        # For each Attribute, the rules (and the bitmask of the Attribute in the rule) it appears in:
+        self.if_rules = [[] for a in self.attributes]
+        self.result_rules = [[] for a in self.attributes]
+        for rule in program.rules:
+            for i, mask in rule.if_masks:
+                self.if_rules[i].append((rule, mask))
+            for i, mask in rule.result_masks:
+                self.result_rules[i].append((rule, mask))
+
+        # For each Attribute, the NOT rules that set it to Empty, and the Attributes whose Empty depends on the IF list
+        # of a rule holding the Attribute:
+        self.emptying_rules = [[] for a in self.attributes]
+        self.empty_dependents = [set() for a in self.attributes]
+        for rule in program.rules:
+            if rule.rule_type == "NOT":
+                for j in rule.full_attributes:
+                    self.emptying_rules[j].append(rule)
+                    self.empty_dependents[j].add(j)
+                    for i, _ in rule.if_masks:
+                        self.empty_dependents[i].add(j)
+
+        self.order = self.get_dependency_order(program)
+
+        # For each position in the order, the later Attributes sharing a rule with the Attribute assigned there. Only
+        # their Variants can be ruled out by that assignment:
+        self.later_neighbours = []
+        for position, i in enumerate(self.order):
+            neighbours = set()
+            for rule, _ in self.if_rules[i] + self.result_rules[i]:
+                neighbours.update(j for j, _ in rule.if_masks + rule.result_masks)
+            self.later_neighbours.append([j for j in self.order[position + 1:] if j in neighbours])
+
+    def get_dependency_order(self, program):
+        """
+        Returns the Attribute indices ordered so that Attributes of IF lists come before the Attributes of the THEN/NOT
+        lists of the same rule. Cycles between rules are broken in hierarchy order.
+        """
+        dependencies = [set() for a in self.attributes]
+        for rule in program.rules:
+            for j, _ in rule.result_masks:
+                dependencies[j].update(i for i, _ in rule.if_masks if i != j)
+
+        order = []
+        remaining = list(range(self.num_attributes))
+        while remaining:
+            ready = [j for j in remaining if not dependencies[j].intersection(remaining)]
+            j = ready[0] if ready else remaining[0]
+            order.append(j)
+            remaining.remove(j)
+        return order
+
+    @staticmethod
+    def rule_selected(rule, values):
+        """True if a Variant of the IF list of rule is selected in values, None being an unassigned Attribute."""
+        return any(values[i] is not None and (mask >> values[i]) & 1 for i, mask in rule.if_masks)
+
+    @staticmethod
+    def rule_broken(rule, values):
+        """True if an assigned Attribute of values breaks the THEN/NOT list of rule."""
+        for i, mask in rule.result_masks:
+            if values[i] is not None and bool((mask >> values[i]) & 1) != (rule.rule_type == "THEN"):
+                return True
+        return False
+
+    def empty_pending(self, i, values):
+        """
+        True if a NOT rule holding the full Attribute i doesn't apply yet, but still may once the unassigned Attributes
+        of its IF list are assigned.
+        """
+        return any(
+            not self.rule_selected(rule, values) and any(values[k] is None and k != i for k, _ in rule.if_masks)
+            for rule in self.emptying_rules[i]
+        )
+
+    def empty_justified(self, i, values):
+        """True if Attribute i is not Empty in values, or a NOT rule holding it applies or still may apply."""
+        return values[i] != 0 or any(self.rule_selected(rule, values) for rule in self.emptying_rules[i]) or \
+            self.empty_pending(i, values)
+
+    def get_domain(self, i, values):
+        """
+        Returns the bitmask of the Variant positions Attribute i may take given the assigned Attributes of values, and
+        whether it may be Empty.
+        """
+        domain = self.full_masks[i]
+        empty_allowed = self.empty_pending(i, values)
+        then_selected = False
+
+        for rule, mask in self.result_rules[i]:
+            if self.rule_selected(rule, values):
+                if rule.rule_type == "THEN":
+                    domain &= mask
+                    then_selected = True
+                else:
+                    domain &= ~mask
+                    empty_allowed |= i in rule.full_attributes
+
+        # Selecting a Variant of an IF list applies its rule, which the assigned Attributes may already break:
+        for rule, mask in self.if_rules[i]:
+            if not self.rule_selected(rule, values) and self.rule_broken(rule, values):
+                domain &= ~mask
+
+        # Empty breaks any THEN rule that applies:
+        return domain, empty_allowed and not then_selected
+
+    def consistent(self, i, values):
+        """
+        True if no rule involving Attribute i is broken by the assigned Attributes of values, and no Attribute left
+        Empty has lost the last NOT rule that could set it. Needed on top of the domain for rules whose IF and THEN/NOT
+        lists share Attribute i, and for Empty drawn ahead of the IF list of its rule.
+        """
+        return not any(
+            self.rule_selected(rule, values) and self.rule_broken(rule, values)
+            for rule, _ in self.if_rules[i] + self.result_rules[i]
+        ) and all(self.empty_justified(j, values) for j in self.empty_dependents[i])
+
+    def forward_check(self, position, values):
+        """True if every Attribute after position in the dependency order can still be assigned."""
+        for i in self.later_neighbours[position]:
+            domain, empty_allowed = self.get_domain(i, values)
+            if not domain and not empty_allowed:
+                return False
+        return True
+
+    def draw_one(self, rng):
+        """Returns one valid DNA row as a list of Variant positions, 0 being Empty, or None if none could be found."""
+        values = [None] * self.num_attributes
+        assignments = 0
+
+        def assign(position):
+            nonlocal assignments
+            if position == self.num_attributes:
+                return True
+
+            i = self.order[position]
+            domain, empty_allowed = self.get_domain(i, values)
+            if empty_allowed and not domain:
+                candidates = [0]
+            elif not self.if_rules[i] and not self.result_rules[i]:
+                # No rule involves this Attribute, any Variant fits:
+                candidates = [self.alias_tables[i].draw_one(rng) + 1]
+            else:
+                candidates = [p for p in range(1, len(self.weights[i]) + 1) if (domain >> p) & 1]
+                weights = [self.weights[i][p - 1] for p in candidates]
+                if sum(weights) > 0:
+                    candidates = [p for p, w in zip(candidates, weights) if w > 0]
+                    weights = [w for w in weights if w > 0]
+                else:
+                    weights = [1.0] * len(candidates)
+
+                # Empty, when its rule may still apply, is drawn as one more Variant of the average weight:
+                if empty_allowed:
+                    candidates.append(0)
+                    weights.append(sum(weights) / len(weights) if weights else 1.0)
+
+                # Weighted random order of the candidates (Efraimidis-Spirakis):
+                keys = rng.random(len(candidates)) ** (1 / np.array(weights))
+                candidates = [candidates[k] for k in np.argsort(-keys)]
+
+            for candidate in candidates:
+                assignments += 1
+                if assignments > self.max_assignments:
+                    return False
+
+                values[i] = candidate
+                if self.consistent(i, values) and self.forward_check(position, values) and assign(position + 1):
+                    return True
+            values[i] = None
+            return False
+
+        return values if assign(0) else None
+
+    def draw(self, rng, size):
+        """Returns a (size x Attributes) matrix of valid DNA rows."""
+        matrix = np.empty((size, self.num_attributes), dtype=np.uint16)
+
+        for row in range(size):
+            values = self.draw_one(rng)
+            if values is None:
+                raise ValueError(
+                    f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
+                    f"No DNA satisfying all Logic rules could be found. Check your rules for conflicts, or use the "
+                    f"Repair logic mode. For more information, see:\n{TextColors.RESET}"
+                    f"https://github.com/torrinworx/Blend_My_NFTs#logic\n"
+                )
+            matrix[row] = values
+
+        return matrix
+
+
+class TooManyCombinations(ValueError):
+    """Raised by ConditionalSampler when Attributes connected by rules have too many combinations to be listed."""
+    pass
+
+
+class ConditionalSampler:
+    """
+    Draws DNA rows that satisfy every rule of a logic.RuleProgram from a single table per group of Attributes connected
+    by rules, so that the realized rarity of each Variant matches its rarity in the .blend file as closely as the rules
+    allow.
+
+    Repairing DNA, or drawing Attributes one at a time among the Variants the rules allow, shifts the rarity of the
+    Attributes involved in rules towards the Variants the rules select. Here, every valid combination of the Attributes
+    of a group is listed once, and weighted by a product of per-Variant factors. The factors are fitted by iterative
+    proportional fitting until the share of each Variant among the weighted combinations matches its rarity. Each DNA
+    is then drawn with one alias table draw per group and per Attribute in no rule, whatever the rules.
+
+    Groups with more than max_assignments combinations to list can't be sampled this way and raise TooManyCombinations.
+    """
+
+    # Largest number of combinations of a group of Attributes connected by rules that is listed:
+    max_assignments = 1 << 20
+
+    # Combinations are checked against the rules in chunks of this many rows:
+    chunk_size = 1 << 16
+
+    # Iterative proportional fitting stops once every Variant share is within fit_tolerance of its target, or after
+    # max_iterations:
+    fit_tolerance = 1e-4
+    max_iterations = 200
+
+    def __init__(self, hierarchy, program, enable_rarity):
+        self.attributes = list(hierarchy.keys())
+        self.num_attributes = len(self.attributes)
+        self.num_variants = program.num_variants
+        self.weights = [get_variant_weights(hierarchy, a, enable_rarity) for a in self.attributes]
+        self.alias_tables = [AliasTable(w) for w in self.weights]
+
+        self.components = program.get_components()
+        in_rules = {i for component in self.components for i in component}
+        self.free_attributes = [i for i in range(self.num_attributes) if i not in in_rules]
+
+        # For each group, the valid combinations as a matrix of its Attribute columns, and their alias table:
+        self.assignments = []
+        self.assignment_tables = []
+        for component in self.components:
+            rules = [rule for rule in program.rules if rule.if_masks and rule.if_masks[0][0] in component]
+            assignments = self.get_valid_assignments(component, rules)
+            if not len(assignments):
+                raise ValueError(
+                    f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
+                    f"No DNA satisfying all Logic rules could be found. Check your rules for conflicts, or use the "
+                    f"Repair logic mode. For more information, see:\n{TextColors.RESET}"
+                    f"https://github.com/torrinworx/Blend_My_NFTs#logic\n"
+                )
+
+            self.assignments.append(assignments)
+            self.assignment_tables.append(AliasTable(self.fit_weights(component, assignments)))
+
+    def get_valid_assignments(self, component, rules):
+        """
+        Returns the (combinations x len(component)) matrix of every combination of the Attributes of component that
+        breaks none of rules. As with repaired DNA, an Attribute is only Empty when a NOT rule holding the full
+        Attribute applies.
+        """
+        emptying_rules = {
+            i: [rule for rule in rules if rule.rule_type == "NOT" and i in rule.full_attributes] for i in component
+        }
+        domains = [
+            np.arange(0 if emptying_rules[i] else 1, self.num_variants[i] + 1, dtype=np.uint16) for i in component
+        ]
+        shape = tuple(len(domain) for domain in domains)
+
+        num_assignments = 1
+        for size in shape:
+            num_assignments *= size
+        if num_assignments > self.max_assignments:
+            raise TooManyCombinations(
+                f"\n{TextColors.ERROR}Blend_My_NFTs Error:\n"
+                f"The Attributes {', '.join(self.attributes[i] for i in component)} are connected by Logic rules into "
+                f"{num_assignments} combinations, too many for the Conditional logic mode. Use the Constraint logic "
+                f"mode instead. For more information, see:\n{TextColors.RESET}"
+                f"https://github.com/torrinworx/Blend_My_NFTs#logic\n"
+            )
+
+        valid_chunks = []
+        for start in range(0, num_assignments, self.chunk_size):
+            indices = np.arange(start, min(start + self.chunk_size, num_assignments))
+            digits = np.unravel_index(indices, shape)
+
+            matrix = np.zeros((len(indices), self.num_attributes), dtype=np.uint16)
+            for column, i in enumerate(component):
+                matrix[:, i] = domains[column][digits[column]]
+
+            valid = np.ones(len(indices), dtype=bool)
+            for rule in rules:
+                valid &= ~rule.violated_rows(matrix, self.num_variants)
+            for i in component:
+                if emptying_rules[i]:
+                    emptied = np.zeros(len(indices), dtype=bool)
+                    for rule in emptying_rules[i]:
+                        emptied |= rule.selected_rows(matrix, self.num_variants)
+                    valid &= (matrix[:, i] != 0) | emptied
+
+            valid_chunks.append(matrix[valid][:, component])
+
+        return np.concatenate(valid_chunks)
+
+    def fit_weights(self, component, assignments):
+        """
+        Returns the weight of each valid combination of component, a product of one factor per selected Variant fitted
+        so that the weighted share of each Variant among non-Empty selections matches its rarity.
+        """
+        targets = [np.asarray(self.weights[i], dtype=np.float64) / sum(self.weights[i]) for i in component]
+        weights = np.ones(len(assignments))
+
+        error = 0.0
+        for iteration in range(self.max_iterations):
+            error = 0.0
+            for column, i in enumerate(component):
+                counts = np.bincount(assignments[:, column], weights=weights, minlength=self.num_variants[i] + 1)[1:]
+                if not counts.sum() > 0:
+                    continue
+
+                shares = counts / counts.sum()
+                error = max(error, np.abs(shares - targets[column]).max())
+
+                # Variants no valid combination selects keep their factor:
+                ratios = np.ones(self.num_variants[i] + 1)
+                selected = shares > 0
+                ratios[1:][selected] = targets[column][selected] / shares[selected]
+                weights *= ratios[assignments[:, column]]
+
+            if error < self.fit_tolerance:
+                break
+
+        if error >= 0.01:
+            log.info(
+                f"\nThe Logic rules don't allow the rarity of {', '.join(self.attributes[i] for i in component)} to be "
+                f"matched exactly, the closest rarity possible is used."
+            )
+        return weights
+
+    def draw(self, rng, size):
+        """Returns a (size x Attributes) matrix of valid DNA rows."""
+        matrix = np.empty((size, self.num_attributes), dtype=np.uint16)
+
+        for i in self.free_attributes:
+            matrix[:, i] = self.alias_tables[i].draw(rng, size) + 1
+
+        for component, assignments, table in zip(self.components, self.assignments, self.assignment_tables):
+            matrix[:, component] = assignments[table.draw(rng, size)]
+
+        return matrix